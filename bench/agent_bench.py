@@ -0,0 +1,352 @@
+"""Benchmarks for the Python agent (payload.py).
+
+Each scenario starts a fresh agent in a subprocess, connected to a local
+stand-in for server.js, sets up its workload through REPL commands and
+then measures it. Results are written as JSON: latency percentiles,
+throughput, and the agent's peak RSS and CPU time per scenario.
+
+    python bench/agent_bench.py -o bench_output.txt
+    python bench/agent_bench.py --scenario dict_1m --framing binary
+    python bench/agent_bench.py --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+PAYLOAD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "payload.py")
+AGENT_ENTRY_POINT = 'run_repl("__HOST__", __PORT__)'
+
+# Same framing as server.js: magic byte, flags, 4 byte big-endian payload length
+FRAME_HEADER = struct.Struct("!BBI")
+FRAME_MAGIC = 0xFE
+FRAME_COMPRESSED = 0x01
+FRAME_MSGPACK = 0x02
+COMPRESSION_THRESHOLD = 4096
+
+# Seconds to wait for the agent to connect, and for any single reply
+CONNECT_TIMEOUT = 30
+REPLY_TIMEOUT = 600
+# Largest message the stand-in server accepts
+READ_LIMIT = 1 << 30
+
+# Module imported by the agent for the inspection scenarios
+BENCH_MODULE_FUNCTIONS = 2500
+BENCH_MODULE_VALUES = 2500
+BENCH_CLASS_METHODS = 500
+
+def write_bench_module(directory):
+    """Write a module with 5k members and a class with 500 methods, all with real source."""
+    lines = ['"""Synthetic module for the agent benchmarks."""', ""]
+    for i in range(BENCH_MODULE_FUNCTIONS):
+        lines += [f"def func_{i}(a, b={i}):", f'    """Function {i}."""', "    return a + b", ""]
+    lines += [f"value_{i} = {i}" for i in range(BENCH_MODULE_VALUES)]
+    lines += ["", "class BenchClass:", '    """Class with many methods."""']
+    for i in range(BENCH_CLASS_METHODS):
+        lines += [f"    def method_{i}(self, x):", f"        return x * {i}", ""]
+    with open(os.path.join(directory, "bench_module.py"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def as_statement(code):
+    """Wrap multi-statement code so it runs as a single REPL statement."""
+    return f"exec({code!r})"
+
+def summarize(samples):
+    """Get latency percentiles in milliseconds from a list of durations in seconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "min_ms": ordered[0] * 1000,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000
+    }
+
+def read_process_cpu(pid):
+    """Get the user plus system CPU seconds of a running process, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are fields 14 and 15, counted after the command name
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+class AgentClient:
+    """The stand-in server's side of one agent connection."""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.framing = None
+        self.bytes_received = 0
+
+    async def recv(self):
+        first = await self.reader.readexactly(1)
+        if first[0] == FRAME_MAGIC:
+            header = first + await self.reader.readexactly(FRAME_HEADER.size - 1)
+            _, flags, length = FRAME_HEADER.unpack(header)
+            payload = await self.reader.readexactly(length)
+            self.bytes_received += FRAME_HEADER.size + length
+            if flags & FRAME_COMPRESSED:
+                payload = zlib.decompress(payload)
+            if flags & FRAME_MSGPACK:
+                raise ValueError("msgpack frames are not supported by the benchmark server")
+            return json.loads(payload)
+        line = first + await self.reader.readline()
+        self.bytes_received += len(line)
+        return json.loads(line)
+
+    async def send(self, message):
+        payload = json.dumps(message).encode("utf-8")
+        if self.framing is None:
+            self.writer.write(payload + b"\n")
+        else:
+            flags = 0
+            if len(payload) >= COMPRESSION_THRESHOLD:
+                payload = zlib.compress(payload, 1)
+                flags |= FRAME_COMPRESSED
+            self.writer.write(FRAME_HEADER.pack(FRAME_MAGIC, flags, len(payload)) + payload)
+        await self.writer.drain()
+
+    async def wait_for(self, predicate, on_message=None):
+        """Read messages until one matches, passing every other one to on_message."""
+        while True:
+            message = await asyncio.wait_for(self.recv(), REPLY_TIMEOUT)
+            if message.get("type") == "error" and "job_id" not in message:
+                raise RuntimeError(f"Agent error: {message.get('error')}")
+            if predicate(message):
+                return message
+            if on_message:
+                on_message(message)
+
+    async def request(self, message, reply_type):
+        """Send a command and get the seconds until its reply arrived."""
+        start = time.perf_counter()
+        await self.send(message)
+        await self.wait_for(lambda reply: reply.get("type") == reply_type)
+        return time.perf_counter() - start
+
+    async def run_code(self, code, on_message=None):
+        """Run REPL code as a job and wait for its result."""
+        await self.send({"type": "repl", "code": code})
+        job = await self.wait_for(lambda reply: reply.get("type") == "job", on_message)
+        result = await self.wait_for(lambda reply: reply.get("job_id") == job["job_id"] and reply.get("type") in ("success", "error"), on_message)
+        if result["type"] == "error":
+            raise RuntimeError(f"Job failed: {result['error']}")
+        return result
+
+async def measure_requests(client, message, reply_type, repeat):
+    """Time a request repeatedly, reporting the first (cold) run apart from the rest."""
+    cold = await client.request(message, reply_type)
+    warm = [await client.request(message, reply_type) for _ in range(repeat)]
+    return {"cold_ms": cold * 1000, **summarize(warm)}
+
+async def bench_module_5k(client, repeat):
+    await client.run_code("import bench_module")
+    return {
+        "inspect": await measure_requests(client, {"type": "inspect", "expression": "bench_module"}, "inspect_result", repeat),
+        "summary": await measure_requests(client, {"type": "inspect", "expression": "bench_module", "mode": "summary"}, "inspect_summary", repeat),
+        "page": await measure_requests(client, {"type": "inspect_page", "expression": "bench_module", "section": "methods", "offset": 1000, "limit": 100}, "inspect_page", repeat)
+    }, {}
+
+async def bench_class_500(client, repeat):
+    await client.run_code("import bench_module; obj = bench_module.BenchClass()")
+    return {
+        "inspect": await measure_requests(client, {"type": "inspect", "expression": "obj"}, "inspect_result", repeat),
+        "summary": await measure_requests(client, {"type": "inspect", "expression": "obj", "mode": "summary"}, "inspect_summary", repeat)
+    }, {}
+
+async def bench_dict_1m(client, repeat):
+    # A full inspect would render every key, only the paged path is measured
+    await client.run_code("big = {f'key_{i}': i for i in range(1000000)}")
+    return {
+        "summary": await measure_requests(client, {"type": "inspect", "expression": "big", "mode": "summary"}, "inspect_summary", repeat),
+        "page": await measure_requests(client, {"type": "inspect_page", "expression": "big", "section": "attributes", "offset": 500000, "limit": 100}, "inspect_page", repeat),
+        "key": await measure_requests(client, {"type": "inspect", "expression": "big['key_999999']", "mode": "summary"}, "inspect_summary", repeat)
+    }, {}
+
+async def bench_print_1m(client, repeat):
+    lines = 1000000
+    received = {"lines": 0, "messages": 0, "bytes": 0}
+
+    def on_message(message):
+        if message.get("type") == "output":
+            received["lines"] += message["data"].count("\n")
+            received["messages"] += 1
+            received["bytes"] += len(message["data"])
+
+    bytes_before = client.bytes_received
+    start = time.perf_counter()
+    await client.run_code(as_statement(f"for i in range({lines}):\n    print(i)\n"), on_message)
+    elapsed = time.perf_counter() - start
+    if received["lines"] != lines:
+        raise RuntimeError(f"Expected {lines} output lines, received {received['lines']}")
+    return {"run": {"count": 1, "elapsed_ms": elapsed * 1000}}, {
+        "lines_per_second": lines / elapsed,
+        "output_messages": received["messages"],
+        "output_mb_per_second": received["bytes"] / elapsed / 1e6,
+        "wire_mb_per_second": (client.bytes_received - bytes_before) / elapsed / 1e6
+    }
+
+async def bench_concurrent_jobs(client, repeat):
+    count = max(repeat, 1) * 10
+    code = "sum(range(200000))"
+    # Replies to repl commands arrive in the order they were sent, results in any order
+    send_times = []
+    submitted = {}
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        send_times.append(time.perf_counter())
+        await client.send({"type": "repl", "code": code})
+    while len(latencies) < count:
+        reply = await client.wait_for(lambda reply: reply.get("type") in ("job", "success", "error"))
+        if reply["type"] == "job":
+            if reply["status"] == "queued" and reply["job_id"] not in submitted:
+                submitted[reply["job_id"]] = send_times[len(submitted)]
+        elif reply["type"] == "error":
+            raise RuntimeError(f"Job failed: {reply['error']}")
+        else:
+            latencies.append(time.perf_counter() - submitted[reply["job_id"]])
+    elapsed = time.perf_counter() - start
+    return {"job": summarize(latencies)}, {"jobs_per_second": count / elapsed}
+
+SCENARIOS = {
+    "module_5k": bench_module_5k,
+    "class_500": bench_class_500,
+    "dict_1m": bench_dict_1m,
+    "print_1m": bench_print_1m,
+    "concurrent_jobs": bench_concurrent_jobs
+}
+
+def write_agent(directory, port):
+    """Write payload.py with its connection placeholders pointing at the stand-in server."""
+    with open(PAYLOAD_PATH) as f:
+        source = f.read()
+    if AGENT_ENTRY_POINT not in source:
+        raise RuntimeError(f"{PAYLOAD_PATH} does not end with {AGENT_ENTRY_POINT}")
+    path = os.path.join(directory, "agent.py")
+    with open(path, "w") as f:
+        f.write(source.replace(AGENT_ENTRY_POINT, f'run_repl("127.0.0.1", {port})'))
+    return path
+
+def stop_agent(agent):
+    """Kill the agent and get its peak RSS and total CPU time from its rusage."""
+    agent.kill()
+    if not hasattr(os, "wait4"):
+        agent.wait()
+        return {}
+    _, _, usage = os.wait4(agent.pid, 0)
+    agent.returncode = -9
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return {"peak_rss_kb": peak_rss_kb, "cpu_user_s": usage.ru_utime, "cpu_system_s": usage.ru_stime}
+
+async def run_scenario(name, directory, framing, repeat):
+    connected = asyncio.get_running_loop().create_future()
+
+    async def on_connect(reader, writer):
+        if not connected.done():
+            connected.set_result(AgentClient(reader, writer))
+
+    server = await asyncio.start_server(on_connect, "127.0.0.1", 0, limit=READ_LIMIT)
+    port = server.sockets[0].getsockname()[1]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [directory, os.environ.get("PYTHONPATH")])))
+    agent = subprocess.Popen([sys.executable, write_agent(directory, port)], env=env, stdout=subprocess.DEVNULL)
+    try:
+        client = await asyncio.wait_for(connected, CONNECT_TIMEOUT)
+        handshake = await client.recv()
+        if framing == "binary":
+            if "binary" not in handshake.get("framing", {}).get("modes", []):
+                raise RuntimeError("The agent does not offer binary framing")
+            await client.send({"type": "framing", "mode": "binary", "encoding": "json", "compression": "zlib", "threshold": COMPRESSION_THRESHOLD})
+            client.framing = "binary"
+
+        cpu_before = read_process_cpu(agent.pid)
+        start = time.perf_counter()
+        measurements, throughput = await SCENARIOS[name](client, repeat)
+        elapsed = time.perf_counter() - start
+        cpu_after = read_process_cpu(agent.pid)
+    finally:
+        usage = stop_agent(agent) if agent.returncode is None else {}
+        server.close()
+        await server.wait_closed()
+
+    # rusage covers the whole agent process including setup, the measured CPU only the scenario
+    if cpu_before is not None and cpu_after is not None:
+        usage["measured_cpu_s"] = cpu_after - cpu_before
+    return {"elapsed_s": elapsed, "measurements": measurements, "throughput": throughput, "agent": usage}
+
+def compare(results, baseline):
+    """Print the p50 and throughput ratios of each measurement against a baseline run."""
+    for name, scenario in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or "error" in scenario or "error" in base:
+            continue
+        for measurement, stats in scenario["measurements"].items():
+            old = base["measurements"].get(measurement, {})
+            key = "p50_ms" if "p50_ms" in stats else "elapsed_ms"
+            if old.get(key):
+                print(f"{name}.{measurement}: {key} {old[key]:.2f} -> {stats[key]:.2f} ({stats[key] / old[key]:.2f}x)", file=sys.stderr)
+        for metric, value in scenario["throughput"].items():
+            old = base["throughput"].get(metric)
+            if old:
+                print(f"{name}.{metric}: {old:.1f} -> {value:.1f} ({value / old:.2f}x)", file=sys.stderr)
+        old_rss = base["agent"].get("peak_rss_kb")
+        if old_rss and scenario["agent"].get("peak_rss_kb"):
+            print(f"{name}.peak_rss_kb: {old_rss} -> {scenario['agent']['peak_rss_kb']}", file=sys.stderr)
+
+async def main(args):
+    results = {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "framing": args.framing,
+        "repeat": args.repeat,
+        "started": time.time(),
+        "scenarios": {}
+    }
+    with tempfile.TemporaryDirectory(prefix="agent_bench_") as directory:
+        write_bench_module(directory)
+        for name in args.scenario or SCENARIOS:
+            print(f"Running {name}...", file=sys.stderr)
+            try:
+                results["scenarios"][name] = await run_scenario(name, directory, args.framing, args.repeat)
+            except Exception as e:
+                results["scenarios"][name] = {"error": f"{type(e).__name__}: {e}"}
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="scenario to run, may be repeated (default: all)")
+    parser.add_argument("--framing", choices=["json", "binary"], default="json", help="framing the stand-in server negotiates")
+    parser.add_argument("--repeat", type=int, default=20, help="timed requests per measurement after one cold request")
+    parser.add_argument("--compare", metavar="BASELINE", help="print ratios against the results of an earlier run")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    sys.exit(1 if any("error" in scenario for scenario in results["scenarios"].values()) else 0)
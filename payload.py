@@ -4,58 +4,776 @@ import sys
 import traceback
 import inspect
 import types
-import io
 import time
-import select
 import threading
 import queue
+import itertools
+import ast
+import os
+import linecache
+import array
+import collections
+from collections import OrderedDict
+import struct
+import zlib
+import asyncio
+import builtins
+import contextvars
+import ctypes
+import reprlib
+import weakref
+import math
+import hashlib
+import functools
+import gc
+import tracemalloc
 from concurrent.futures import ThreadPoolExecutor
 
-class SocketWriter(io.IOBase):
-    def __init__(self, sock):
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Paged inspection limits
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_SUMMARY_NAMES = 5000
+
+# Member names reused by the pages of a recent inspection: seconds they stay valid, expressions kept
+MEMBER_NAMES_TTL = 30.0
+MEMBER_NAMES_CACHE_SIZE = 64
+
+# Batch inspection: results per inspect_batch reply, levels below the root
+MAX_BATCH_SIZE = 1000
+MAX_BATCH_DEPTH = 5
+
+# Compiled code objects and parsed inspect paths kept for repeated commands, largest source cached
+CODE_CACHE_SIZE = 512
+CODE_CACHE_MAX_SOURCE = 64 * 1024
+PATH_CACHE_SIZE = 4096
+EXECUTION_MODES = ("single", "exec", "eval")
+
+# Delta inspection: expressions whose member fingerprints are kept, versions kept per expression
+INSPECT_HISTORY_SIZE = 256
+INSPECT_HISTORY_VERSIONS = 4
+
+# Callable metadata cache size
+CALLABLE_CACHE_SIZE = 4096
+
+# Value rendering: maximum characters shown, time after which a type is no longer rendered,
+# seconds before a slow type is tried again
+VALUE_MAX_LENGTH = 1000
+RENDER_TIME_BUDGET = 0.05
+RENDER_SLOW_TTL = 60.0
+CONTAINER_TYPES = (list, tuple, dict, set, frozenset, collections.deque, array.array)
+
+# Source index limits
+SOURCE_INDEX_SIZE = 256
+SOURCE_CHECK_INTERVAL = 1.0
+
+# Binary framing: magic byte, flags, payload length
+FRAME_HEADER = struct.Struct("!BBI")
+FRAME_MAGIC = 0xFE
+FRAME_COMPRESSED = 0x01
+FRAME_MSGPACK = 0x02
+COMPRESSION_THRESHOLD = 4096
+
+# Output batching and backpressure
+OUTPUT_BATCH_BYTES = 64 * 1024
+OUTPUT_QUEUE_SIZE = 4096
+OUTPUT_PUT_TIMEOUT = 5.0
+OUTPUT_FLUSH_INTERVAL = 0.002
+
+# Outbound socket queue: bytes above which output waits, frames per sendmsg call
+OUTBOUND_HIGH_WATER = 1024 * 1024
+SENDMSG_MAX_FRAMES = 64
+
+# Worker threads running REPL code
+EXECUTOR_WORKERS = 4
+
+# Jobs: default wall-clock timeout in seconds (None for no timeout), finished jobs kept
+DEFAULT_JOB_TIMEOUT = None
+JOB_HISTORY_SIZE = 100
+
+# Sampling profiler limits: seconds, samples per second
+MAX_PROFILE_DURATION = 300
+MAX_PROFILE_RATE = 1000
+
+# Heap census: objects counted between yields to the loop, seconds between partial results,
+# rows reported, tracemalloc snapshots kept for diffing
+HEAP_CHUNK_SIZE = 10000
+HEAP_PROGRESS_INTERVAL = 0.25
+HEAP_TOP_N = 50
+HEAP_SNAPSHOT_HISTORY = 8
+
+# Object graphs: default and largest node budget, edges allowed per node in the budget, largest depth,
+# default and largest time budget in seconds, objects or references handled between yields to the loop,
+# characters in a node label
+DEFAULT_GRAPH_NODES = 200
+MAX_GRAPH_NODES = 5000
+GRAPH_EDGES_PER_NODE = 10
+MAX_GRAPH_DEPTH = 10
+DEFAULT_GRAPH_TIME = 2.0
+MAX_GRAPH_TIME = 30.0
+GRAPH_CHUNK_SIZE = 50
+GRAPH_LABEL_LENGTH = 80
+
+# Watches: shortest and default evaluation interval in seconds, watches per session, threads
+# evaluating them (apart from the REPL workers), seconds one evaluation may run before its watch is disabled
+MIN_WATCH_INTERVAL = 0.1
+DEFAULT_WATCH_INTERVAL = 1.0
+MAX_WATCHES = 64
+WATCH_WORKERS = 2
+WATCH_TIME_BUDGET = 1.0
+
+# Agent stats: histogram resolution in buckets per doubling, shortest periodic report interval in seconds
+HISTOGRAM_BUCKETS_PER_OCTAVE = 8
+MIN_STATS_INTERVAL = 0.5
+
+# Session used by commands that do not name one
+DEFAULT_SESSION = "default"
+
+# Command types handle_command accepts, any other is counted in the stats as "unknown"
+COMMAND_TYPES = frozenset((
+    "repl", "jobs", "job_status", "cancel", "inspect", "inspect_page", "inspect_batch",
+    "watch", "unwatch", "watches", "graph", "profile", "heap", "stats", "session_close"
+))
+
+class MessageCodec:
+    """Encode and decode agent messages as JSON lines or length-prefixed binary frames.
+
+    JSON lines are used until the server picks a framing mode in reply to
+    the status handshake. Decoding accepts both formats at any time, since
+    binary frames start with a magic byte that can never begin a JSON line.
+    """
+    def __init__(self):
+        self.mode = "json"
+        self.encoding = "json"
+        self.compression = None
+        self.threshold = COMPRESSION_THRESHOLD
+        self.buffer = bytearray()
+    
+    def get_offer(self):
+        """Get the framing options offered to the server in the status handshake."""
+        return {
+            "modes": ["binary", "json"],
+            "encodings": ["msgpack", "json"] if msgpack else ["json"],
+            "compression": ["zlib"]
+        }
+    
+    def configure(self, framing):
+        """Apply the framing mode chosen by the server."""
+        mode = framing.get("mode", "json")
+        if mode not in ("json", "binary"):
+            raise ValueError(f"Unsupported framing mode: {mode}")
+        encoding = framing.get("encoding", "json")
+        if encoding not in ("json", "msgpack") or (encoding == "msgpack" and not msgpack):
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        compression = framing.get("compression")
+        if compression not in (None, "zlib"):
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.mode = mode
+        self.encoding = encoding
+        self.compression = compression
+        self.threshold = int(framing.get("threshold", COMPRESSION_THRESHOLD))
+    
+    def encode(self, message):
+        if self.mode == "json":
+            return json.dumps(message).encode("utf-8") + b"\n"
+        
+        flags = 0
+        if self.encoding == "msgpack":
+            payload = msgpack.packb(message, use_bin_type=True, default=str)
+            flags |= FRAME_MSGPACK
+        else:
+            payload = json.dumps(message).encode("utf-8")
+        if self.compression == "zlib" and len(payload) >= self.threshold:
+            payload = zlib.compress(payload, 1)
+            flags |= FRAME_COMPRESSED
+        return FRAME_HEADER.pack(FRAME_MAGIC, flags, len(payload)) + payload
+    
+    def feed(self, data):
+        """Buffer received data and yield (payload, flags) for every complete message."""
+        self.buffer += data
+        while self.buffer:
+            if self.buffer[0] == FRAME_MAGIC:
+                if len(self.buffer) < FRAME_HEADER.size:
+                    return
+                _, flags, length = FRAME_HEADER.unpack_from(self.buffer)
+                end = FRAME_HEADER.size + length
+                if len(self.buffer) < end:
+                    return
+                payload = bytes(self.buffer[FRAME_HEADER.size:end])
+                del self.buffer[:end]
+                yield payload, flags
+            else:
+                end = self.buffer.find(b"\n")
+                if end == -1:
+                    return
+                payload = bytes(self.buffer[:end])
+                del self.buffer[:end + 1]
+                yield payload, 0
+    
+    def decode(self, payload, flags):
+        if flags & FRAME_COMPRESSED:
+            payload = zlib.decompress(payload)
+        if flags & FRAME_MSGPACK:
+            if not msgpack:
+                raise ValueError("Received a msgpack frame but msgpack is not installed")
+            return msgpack.unpackb(payload, raw=False)
+        return json.loads(payload.decode("utf-8", "replace"))
+
+class AgentConnection:
+    """Owns the agent socket on the event loop.
+
+    Any thread may call send(). Frames are handed to the loop with
+    call_soon_threadsafe and appended to the outbound queue, and a
+    single writer task writes everything pending with one sendmsg()
+    scatter-gather call where the platform supports it. Producers that
+    can wait call drain() to stay below the high-water mark.
+    """
+    def __init__(self, loop, sock, codec, high_water=OUTBOUND_HIGH_WATER):
+        self.loop = loop
         self.sock = sock
-        self.buffer = ""
+        self.codec = codec
+        self.high_water = high_water
+        self.thread_id = threading.get_ident()
+        self.scatter = hasattr(sock, "sendmsg") and sys.platform != "win32"
+        self.pending = collections.deque()
+        self.pending_bytes = 0
+        self.wakeup = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.drained.set()
+        # Counters
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.send_calls = 0
+        self.max_pending_bytes = 0
     
-    def write(self, data):
-        if data:
-            # Buffer the data and send on newline
-            self.buffer += data
-            if '\n' in self.buffer:
-                lines = self.buffer.split('\n')
-                self.buffer = lines[-1]  # Keep any remaining data without newline
-                
-                # Send complete lines
-                for line in lines[:-1]:
-                    if line:  # Only send non-empty lines
-                        response = {
-                            "type": "output",
-                            "data": line + '\n'
-                        }
-                        self.sock.sendall(json.dumps(response).encode("utf-8") + b"\n")
-        return len(data)
+    def send(self, message):
+        frame = self.codec.encode(message)
+        agent_stats.record_size(message.get("type"), len(frame))
+        if threading.get_ident() == self.thread_id:
+            self.enqueue(frame)
+        else:
+            self.loop.call_soon_threadsafe(self.enqueue, frame)
     
-    def flush(self):
-        # Send any remaining buffered data
-        if self.buffer:
-            response = {
-                "type": "output",
-                "data": self.buffer
+    def enqueue(self, frame):
+        self.pending.append(frame)
+        self.pending_bytes += len(frame)
+        self.max_pending_bytes = max(self.max_pending_bytes, self.pending_bytes)
+        if self.pending_bytes >= self.high_water:
+            self.drained.clear()
+        self.wakeup.set()
+    
+    async def drain(self):
+        """Wait until the outbound queue is below the high-water mark."""
+        await self.drained.wait()
+    
+    def get_counters(self):
+        return {
+            "queue_frames": len(self.pending),
+            "queue_bytes": self.pending_bytes,
+            "max_queue_bytes": self.max_pending_bytes,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "send_calls": self.send_calls
+        }
+    
+    async def run_writer(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                agent_stats.record_gauge("outbound_bytes", self.pending_bytes)
+                frames = list(itertools.islice(self.pending, SENDMSG_MAX_FRAMES))
+                start = time.perf_counter()
+                sent = await self.write_frames(frames)
+                agent_stats.record("writer", "socket", time.perf_counter() - start)
+                self.consume(sent)
+    
+    async def write_frames(self, frames):
+        if not self.scatter:
+            data = b"".join(frames)
+            await self.loop.sock_sendall(self.sock, data)
+            return len(data)
+        while True:
+            try:
+                return self.sock.sendmsg(frames)
+            except (BlockingIOError, InterruptedError):
+                await self.wait_writable()
+    
+    async def wait_writable(self):
+        ready = self.loop.create_future()
+        fd = self.sock.fileno()
+        self.loop.add_writer(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            self.loop.remove_writer(fd)
+    
+    def consume(self, sent):
+        """Drop what was written from the outbound queue, keeping the unsent rest of a partial frame."""
+        self.send_calls += 1
+        self.bytes_sent += sent
+        self.pending_bytes -= sent
+        while sent:
+            frame = self.pending[0]
+            if sent >= len(frame):
+                self.pending.popleft()
+                self.frames_sent += 1
+                sent -= len(frame)
+            else:
+                self.pending[0] = memoryview(frame)[sent:]
+                sent = 0
+        if self.pending_bytes < self.high_water // 2:
+            self.drained.set()
+
+class OutputQueue(queue.Queue):
+    """Bounded output queue that wakes the event loop when output is pending."""
+    def __init__(self, loop, maxsize=OUTPUT_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self.loop = loop
+        self.ready = asyncio.Event()
+        self.scheduled = False
+    
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self.wake()
+    
+    def put_control(self, item):
+        """Queue a job result or status past the size bound, never blocking the caller.
+
+        Used from future callbacks, which may run on the event loop that
+        drains this queue. There is one such message per job, so the queue
+        cannot grow much past its bound this way.
+        """
+        with self.mutex:
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        self.wake()
+    
+    def wake(self):
+        # Only the first put after a drain has to wake the loop
+        with self.mutex:
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.loop.call_soon_threadsafe(self.ready.set)
+    
+    async def wait(self):
+        await self.ready.wait()
+        self.ready.clear()
+        with self.mutex:
+            self.scheduled = False
+
+class Histogram:
+    """Log-bucketed histogram with a fixed relative error and constant cost per value."""
+    __slots__ = ('buckets', 'count', 'total', 'min', 'max')
+    
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+    
+    def add(self, value):
+        bucket = math.floor(math.log2(value) * HISTOGRAM_BUCKETS_PER_OCTAVE) if value > 0 else None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    
+    def get_percentile(self, fraction):
+        """Get the upper bound of the bucket holding the given fraction of values."""
+        rank = fraction * self.count
+        seen = 0
+        # Zero and negative values sort first
+        for bucket in sorted(self.buckets, key=lambda b: -math.inf if b is None else b):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                if bucket is None:
+                    return 0
+                return min(2 ** ((bucket + 1) / HISTOGRAM_BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+    
+    def get_summary(self, scale=1):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count * scale,
+            'min': self.min * scale,
+            'p50': self.get_percentile(0.5) * scale,
+            'p95': self.get_percentile(0.95) * scale,
+            'p99': self.get_percentile(0.99) * scale,
+            'max': self.max * scale
+        }
+
+class AgentStats:
+    """The agent's own timings and queue sizes.
+
+    Timings are kept per group (a command type, or a part of the agent
+    such as object_info or execute_code) and phase. Message sizes are
+    kept per message type and gauges are sampled where they change.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.timings = {}
+        self.sizes = {}
+        self.gauges = {}
+        self.busy_workers = 0
+        self.reporter = None
+        self.reporter_session = None
+    
+    def get_histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram()
+        return histogram
+    
+    def record(self, group, phase, seconds):
+        with self.lock:
+            self.get_histogram(self.timings, (group, phase)).add(seconds)
+    
+    def record_size(self, message_type, size):
+        with self.lock:
+            self.get_histogram(self.sizes, message_type).add(size)
+    
+    def record_gauge(self, name, value):
+        with self.lock:
+            self.get_histogram(self.gauges, name).add(value)
+    
+    def worker_started(self):
+        with self.lock:
+            self.busy_workers += 1
+            self.get_histogram(self.gauges, "busy_workers").add(self.busy_workers)
+    
+    def worker_finished(self):
+        with self.lock:
+            self.busy_workers -= 1
+    
+    def reset(self):
+        with self.lock:
+            self.timings.clear()
+            self.sizes.clear()
+            self.gauges.clear()
+            self.started = time.time()
+    
+    def get_report(self, writer=None, output_queue=None):
+        """Get every histogram summary, timings in milliseconds."""
+        with self.lock:
+            timings = {}
+            for (group, phase), histogram in sorted(self.timings.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+                timings.setdefault(str(group), {})[phase] = histogram.get_summary(1000)
+            report = {
+                "since": self.started,
+                "timings": timings,
+                "message_bytes": {str(message_type): histogram.get_summary() for message_type, histogram in self.sizes.items()},
+                "gauges": {name: histogram.get_summary() for name, histogram in self.gauges.items()},
+                "executor": {"workers": EXECUTOR_WORKERS, "busy": self.busy_workers}
             }
-            self.sock.sendall(json.dumps(response).encode("utf-8") + b"\n")
-            self.buffer = ""
+        if output_queue is not None:
+            report["output_queue"] = {"depth": output_queue.qsize(), "maxsize": output_queue.maxsize}
+        if writer is not None:
+            report["writer"] = writer.get_counters()
+        report["callable_cache"] = {
+            "hits": callable_cache.hits,
+            "misses": callable_cache.misses,
+            "size": len(callable_cache.entries)
+        }
+        for name, cache in (("code_cache", compile_cached), ("path_cache", parse_inspect_path)):
+            info = cache.cache_info()
+            report[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+        return report
+    
+    def start_reporting(self, interval, writer, output_queue, session_id=None):
+        """Send the report as a status frame every interval seconds, replacing any earlier reporter."""
+        self.stop_reporting()
+        
+        async def report():
+            while True:
+                await asyncio.sleep(interval)
+                await writer.drain()
+                status = {"type": "status", "status": "connected", "stats": self.get_report(writer, output_queue)}
+                writer.send(tag_session(status, session_id))
+        
+        self.reporter = asyncio.get_running_loop().create_task(report())
+        self.reporter_session = session_id
+    
+    def stop_reporting(self):
+        if self.reporter is not None:
+            self.reporter.cancel()
+            self.reporter = None
+            self.reporter_session = None
+
+agent_stats = AgentStats()
+
+def get_error_entry(e):
+    """Get the entry reported for a member that could not be read."""
+    return {
+        'type': 'error',
+        'error_type': type(e).__name__,
+        'error': str(e)
+    }
+
+class SourceIndex:
+    """Per-file index of function and class definitions, parsed once with ast.
 
-class ThreadSafeSocketWriter(SocketWriter):
-    def __init__(self, sock):
-        super().__init__(sock)
+    Each file maps the first line (decorators included) and the qualname of
+    every definition to its decorators and line range. A file is parsed
+    again only when its mtime changes.
+    """
+    def __init__(self, maxsize=SOURCE_INDEX_SIZE, check_interval=SOURCE_CHECK_INTERVAL):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self.files = OrderedDict()
         self.lock = threading.Lock()
     
-    def write(self, data):
+    def get_file(self, filename):
+        now = time.monotonic()
+        with self.lock:
+            index = self.files.get(filename)
+            if index is not None:
+                self.files.move_to_end(filename)
+                if now - index['checked'] < self.check_interval:
+                    return index
+        
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            mtime = None
+        if index is not None and index['mtime'] == mtime:
+            index['checked'] = now
+            return index
+        
+        linecache.checkcache(filename)
+        lines = linecache.getlines(filename)
+        index = {'mtime': mtime, 'checked': now, 'lines': lines, 'by_line': {}, 'by_qualname': {}}
+        if lines:
+            try:
+                source = ''.join(lines)
+                self.index_definitions(ast.parse(source, filename), source, [], index)
+            except (SyntaxError, ValueError):
+                pass
+        
         with self.lock:
-            return super().write(data)
+            self.files[filename] = index
+            self.files.move_to_end(filename)
+            while len(self.files) > self.maxsize:
+                self.files.popitem(last=False)
+        return index
     
-    def flush(self):
+    def index_definitions(self, node, source, scope, index):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualname = '.'.join(scope + [child.name])
+                start = min([child.lineno] + [d.lineno for d in child.decorator_list])
+                definition = {
+                    'qualname': qualname,
+                    'start': start,
+                    'end': child.end_lineno,
+                    'lines': index['lines'],
+                    'decorators': ['@' + (ast.get_source_segment(source, d) or ast.unparse(d)) for d in child.decorator_list]
+                }
+                index['by_line'][start] = definition
+                index['by_qualname'].setdefault(qualname, definition)
+                if isinstance(child, ast.ClassDef):
+                    self.index_definitions(child, source, scope + [child.name], index)
+                else:
+                    self.index_definitions(child, source, scope + [child.name, '<locals>'], index)
+            else:
+                self.index_definitions(child, source, scope, index)
+    
+    def get_definition(self, attr):
+        """Get the indexed definition of a function or method, or None."""
+        try:
+            func = inspect.unwrap(attr)
+            func = getattr(func, '__func__', func)
+            code = func.__code__
+        except (AttributeError, ValueError):
+            return None
+        index = self.get_file(code.co_filename)
+        definition = index['by_line'].get(code.co_firstlineno)
+        if definition is None:
+            definition = index['by_qualname'].get(getattr(func, '__qualname__', None))
+        return definition
+    
+    def get_source(self, attr):
+        """Get the source of a function or method, falling back to inspect for anything not indexed."""
+        definition = self.get_definition(attr)
+        if definition is not None:
+            return ''.join(definition['lines'][definition['start'] - 1:definition['end']])
+        try:
+            return inspect.getsource(attr)
+        except (TypeError, OSError):
+            return None
+
+source_index = SourceIndex()
+
+class CallableInfoCache:
+    """Bounded LRU cache of callable metadata that does not depend on the inspected instance.
+
+    Entries are keyed by owner (class or module), member name and the
+    type of the looked up attribute, so a class's plain function and an
+    instance's bound method get separate signatures. They only hit while
+    the underlying code object or static attribute is the same one and the
+    owner's namespace fingerprint has not changed.
+    """
+    def __init__(self, maxsize=CALLABLE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, owner, name, kind, ident, fingerprint):
         with self.lock:
-            super().flush()
+            key = (id(owner), name, kind)
+            entry = self.entries.get(key)
+            if entry is None or entry[0] is not owner or entry[1] is not ident or entry[2] != fingerprint:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+    
+    def put(self, owner, name, kind, ident, fingerprint, metadata):
+        with self.lock:
+            key = (id(owner), name, kind)
+            self.entries[key] = (owner, ident, fingerprint, metadata)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+callable_cache = CallableInfoCache()
+
+def get_metadata_owner(obj):
+    """Get the class or module whose namespace defines the callables of an object."""
+    if inspect.ismodule(obj) or inspect.isclass(obj):
+        return obj
+    return type(obj)
+
+def get_namespace_fingerprint(owner):
+    """Get a fingerprint that changes whenever a class's or module's attributes change."""
+    try:
+        if inspect.isclass(owner):
+            namespaces = [vars(klass) for klass in owner.__mro__]
+        else:
+            namespaces = [vars(owner)]
+        return hash(tuple((name, id(value)) for namespace in namespaces for name, value in list(namespace.items())))
+    except Exception:
+        return None
+
+def get_callable_metadata(obj, name, attr):
+    """Get the metadata of a callable that only changes when its class or module changes."""
+    # Get full signature including return type annotations if available
+    try:
+        sig = inspect.signature(attr)
+        return_annotation = sig.return_annotation
+        if return_annotation is not inspect.Signature.empty:
+            return_type = return_annotation.__name__ if hasattr(return_annotation, '__name__') else str(return_annotation)
+        else:
+            return_type = None
+    except ValueError:
+        sig = None
+        return_type = None
+    
+    # Get source if available
+    start = time.perf_counter()
+    source = source_index.get_source(attr) if inspect.isfunction(attr) or inspect.ismethod(attr) else None
+    agent_stats.record("object_info", "source", time.perf_counter() - start)
+    
+    # Get parameter count to help determine runnability
+    try:
+        params = list(sig.parameters.values()) if sig else []
+        required_params = sum(1 for p in params if p.default == inspect.Parameter.empty and p.kind not in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD))
+    except:
+        required_params = 0
+    
+    return {
+        'doc': inspect.getdoc(attr) or "No documentation available",
+        'signature': str(sig) if sig else "Signature unavailable",
+        'return_type': return_type,
+        'required_params': required_params,
+        'source_file': inspect.getfile(attr) if inspect.isfunction(attr) else None,
+        'source': source,
+        'is_async': inspect.iscoroutinefunction(attr) or inspect.isasyncgenfunction(attr),
+        'is_generator': inspect.isgeneratorfunction(attr),
+        'decorators': get_decorator_info(attr, obj, name)
+    }
+
+def get_callable_entry(obj, name, attr, fingerprint=None):
+    """Get information about a single callable of an object."""
+    owner = get_metadata_owner(obj)
+    if fingerprint is None:
+        fingerprint = get_namespace_fingerprint(owner)
+    
+    # Key Python functions by their code object, anything else by the attribute as stored
+    ident = getattr(getattr(attr, '__func__', attr), '__code__', None)
+    if ident is None:
+        ident = inspect.getattr_static(obj, name, None)
+    
+    # The signature of a function differs from that of the same function bound to an instance
+    kind = type(attr)
+    metadata = callable_cache.get(owner, name, kind, ident, fingerprint) if fingerprint is not None else None
+    if metadata is None:
+        metadata = get_callable_metadata(obj, name, attr)
+        if fingerprint is not None:
+            callable_cache.put(owner, name, kind, ident, fingerprint, metadata)
+    
+    # Determine method type and runnability
+    is_runnable = False
+    if isinstance(attr, staticmethod):
+        method_type = 'static'
+        is_runnable = True
+    elif inspect.isfunction(attr):
+        if isinstance(obj, type) and getattr(obj, name, None) is attr:
+            method_type = 'static'
+            is_runnable = True
+        else:
+            method_type = 'function'
+            is_runnable = not inspect.isclass(obj)
+    elif inspect.ismethod(attr):
+        if attr.__self__ is obj:
+            method_type = 'class'
+            is_runnable = True
+        else:
+            method_type = 'instance'
+            is_runnable = not inspect.isclass(obj)
+    else:
+        method_type = 'other'
+        is_runnable = True
+    
+    # If it requires parameters, it's not directly runnable
+    if metadata['required_params'] > 0:
+        is_runnable = False
+    
+    return {
+        'type': 'method',
+        'method_type': method_type,
+        'callable_type': type(attr).__name__,
+        'is_runnable': is_runnable,
+        'doc': metadata['doc'],
+        'signature': metadata['signature'],
+        'return_type': metadata['return_type'],
+        'source_file': metadata['source_file'],
+        'source': metadata['source'],
+        'is_async': metadata['is_async'],
+        'is_generator': metadata['is_generator'],
+        'is_property': isinstance(attr, property),
+        'decorators': metadata['decorators']
+    }
 
 def get_callable_info(obj):
     """Get information about object callables."""
@@ -63,83 +781,15 @@ def get_callable_info(obj):
     try:
         # For dictionaries, we want to show all methods
         show_private = isinstance(obj, dict)
+        fingerprint = get_namespace_fingerprint(get_metadata_owner(obj))
         for name in dir(obj):
             if show_private or not name.startswith('_'):
                 try:
                     attr = getattr(obj, name)
                     if callable(attr):
-                        # Get full signature including return type annotations if available
-                        try:
-                            sig = inspect.signature(attr)
-                            return_annotation = sig.return_annotation
-                            if return_annotation is not inspect.Signature.empty:
-                                return_type = return_annotation.__name__ if hasattr(return_annotation, '__name__') else str(return_annotation)
-                            else:
-                                return_type = None
-                        except ValueError:
-                            sig = None
-                            return_type = None
-                        
-                        # Determine method type and runnability
-                        is_runnable = False
-                        if isinstance(attr, staticmethod):
-                            method_type = 'static'
-                            is_runnable = True
-                        elif inspect.isfunction(attr):
-                            if isinstance(obj, type) and getattr(obj, name, None) is attr:
-                                method_type = 'static'
-                                is_runnable = True
-                            else:
-                                method_type = 'function'
-                                is_runnable = not inspect.isclass(obj)
-                        elif inspect.ismethod(attr):
-                            if attr.__self__ is obj:
-                                method_type = 'class'
-                                is_runnable = True
-                            else:
-                                method_type = 'instance'
-                                is_runnable = not inspect.isclass(obj)
-                        else:
-                            method_type = 'other'
-                            is_runnable = True
-                        
-                        # Get source if available
-                        try:
-                            source = inspect.getsource(attr) if inspect.isfunction(attr) or inspect.ismethod(attr) else None
-                        except (TypeError, OSError):
-                            source = None
-                        
-                        # Get parameter count to help determine runnability
-                        try:
-                            params = list(sig.parameters.values()) if sig else []
-                            required_params = sum(1 for p in params if p.default == inspect.Parameter.empty and p.kind not in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD))
-                            # If it requires parameters, it's not directly runnable
-                            if required_params > 0:
-                                is_runnable = False
-                        except:
-                            pass
-                        
-                        callables[name] = {
-                            'type': 'method',
-                            'method_type': method_type,
-                            'callable_type': type(attr).__name__,
-                            'is_runnable': is_runnable,
-                            'doc': inspect.getdoc(attr) or "No documentation available",
-                            'signature': str(sig) if sig else "Signature unavailable",
-                            'return_type': return_type,
-                            'source_file': inspect.getfile(attr) if inspect.isfunction(attr) else None,
-                            'source': source,
-                            'is_async': inspect.iscoroutinefunction(attr) or inspect.isasyncgenfunction(attr),
-                            'is_generator': inspect.isgeneratorfunction(attr),
-                            'is_property': isinstance(attr, property),
-                            'decorators': get_decorator_info(attr, obj, name)
-                        }
+                        callables[name] = get_callable_entry(obj, name, attr, fingerprint)
                 except Exception as e:
-                    callables[name] = {
-                        'type': 'error',
-                        'error_type': type(e).__name__,
-                        'error': str(e)
-                    }
+                    callables[name] = get_error_entry(e)
     except Exception as e:
         print(f"Error getting callables: {e}")
     return callables
@@ -156,23 +806,136 @@ def get_decorator_info(attr, obj, name):
         elif isinstance(attr, property):
             decorators.append('@property')
         
-        # Try to get source and parse decorators
-        try:
-            source = inspect.getsource(attr)
-            lines = source.split('\n')
-            # Look for decorator lines before the def
-            for line in lines:
-                line = line.strip()
-                if line.startswith('def '):
-                    break
-                if line.startswith('@') and line not in decorators:
-                    decorators.append(line)
-        except:
-            pass
+        # Look up the decorators parsed from the source file
+        definition = source_index.get_definition(attr)
+        if definition:
+            for decorator in definition['decorators']:
+                if decorator not in decorators:
+                    decorators.append(decorator)
     except:
         pass
     return decorators
 
+class ValueRenderer(reprlib.Repr):
+    """Render values for display at a bounded cost, however big they are.
+
+    Strings and bytes are sliced before anything is copied, containers
+    (subclasses included) go through reprlib depth and width limits
+    without sorting, and any type whose __str__/__repr__ took longer than
+    the time budget is shown by type and address for the next
+    RENDER_SLOW_TTL seconds.
+    """
+    def __init__(self, maxlength=VALUE_MAX_LENGTH, budget=RENDER_TIME_BUDGET, slow_ttl=RENDER_SLOW_TTL):
+        super().__init__()
+        self.maxlength = maxlength
+        self.budget = budget
+        self.slow_ttl = slow_ttl
+        self.maxlevel = 3
+        self.maxtuple = self.maxlist = self.maxarray = self.maxdeque = 10
+        self.maxdict = self.maxset = self.maxfrozenset = 10
+        self.maxstring = self.maxother = 200
+        self.slow_types = weakref.WeakKeyDictionary()
+    
+    def render(self, value, maxlength=None):
+        """Render a value the way str() would, truncated to maxlength characters."""
+        maxlength = maxlength or self.maxlength
+        if isinstance(value, str):
+            return self.truncate(value, maxlength)
+        if isinstance(value, (bytes, bytearray)):
+            return self.truncate(self.repr_sliced(value, maxlength), maxlength)
+        if isinstance(value, CONTAINER_TYPES) or type(value) is int:
+            return self.truncate(self.repr(value), maxlength)
+        return self.call_budgeted(str, value, maxlength)
+    
+    def truncate(self, text, maxlength):
+        if len(text) > maxlength:
+            return text[:maxlength] + '...'
+        return text
+    
+    def call_budgeted(self, func, value, maxlength):
+        cls = type(value)
+        slow = self.slow_types.get(cls)
+        if slow is not None:
+            cost, until = slow
+            if time.monotonic() < until:
+                return f"<{cls.__name__} object at {id(value):#x}, not rendered: took {cost * 1000:.0f} ms before>"
+            del self.slow_types[cls]
+        start = time.perf_counter()
+        text = func(value)
+        elapsed = time.perf_counter() - start
+        if elapsed > self.budget:
+            self.slow_types[cls] = (elapsed, time.monotonic() + self.slow_ttl)
+        return self.truncate(text, maxlength)
+    
+    def repr_sliced(self, x, limit):
+        # Slice first, the repr of a whole large bytes value is several times its size
+        text = repr(x[:limit])
+        if len(x) > limit:
+            text += self.fillvalue
+        return text
+    
+    def repr1(self, x, level):
+        cls = type(x)
+        if cls not in CONTAINER_TYPES and isinstance(x, CONTAINER_TYPES):
+            # Subclasses such as OrderedDict, defaultdict and Counter get their base type's bounded repr,
+            # their own could copy contents of any size
+            if isinstance(x, tuple) and isinstance(getattr(cls, '_fields', None), tuple):
+                return self.repr_namedtuple(x, level)
+            base = next(base for base in CONTAINER_TYPES if isinstance(x, base))
+            return f"{cls.__name__}({getattr(self, 'repr_' + base.__name__)(x, level)})"
+        if isinstance(x, (bytes, bytearray)):
+            return self.repr_sliced(x, self.maxother)
+        return super().repr1(x, level)
+    
+    def repr_namedtuple(self, x, level):
+        if level <= 0:
+            return f"{type(x).__name__}({self.fillvalue})"
+        pieces = [f"{name}={self.repr1(value, level - 1)}" for name, value in zip(itertools.islice(type(x)._fields, self.maxtuple), x)]
+        if len(x) > self.maxtuple:
+            pieces.append(self.fillvalue)
+        return f"{type(x).__name__}({', '.join(pieces)})"
+    
+    def repr_int(self, x, level):
+        if x.bit_length() > 4 * self.maxother:
+            return f"<int with {x.bit_length()} bits>"
+        return super().repr_int(x, level)
+    
+    def repr_dict(self, x, level):
+        # Same as reprlib, but sample items in order instead of sorting every key
+        if not x:
+            return '{}'
+        if level <= 0:
+            return '{' + self.fillvalue + '}'
+        pieces = []
+        for key, value in itertools.islice(x.items(), self.maxdict):
+            pieces.append('%s: %s' % (self.repr1(key, level - 1), self.repr1(value, level - 1)))
+        if len(x) > self.maxdict:
+            pieces.append(self.fillvalue)
+        return '{%s}' % ', '.join(pieces)
+    
+    def repr_set(self, x, level):
+        if not x:
+            return 'set()'
+        return self._repr_iterable(x, level, '{', '}', self.maxset)
+    
+    def repr_frozenset(self, x, level):
+        if not x:
+            return 'frozenset()'
+        return self._repr_iterable(x, level, 'frozenset({', '})', self.maxfrozenset)
+    
+    def repr_instance(self, x, level):
+        return self.call_budgeted(repr, x, self.maxother)
+
+value_renderer = ValueRenderer()
+
+def get_attribute_entry(value):
+    """Get information about a single attribute value."""
+    return {
+        'type': type(value).__name__,
+        'category': get_object_category(value),
+        'value': value_renderer.render(value) if not isinstance(value, (dict, list, tuple, set)) else f"{type(value).__name__}({len(value)} items)"
+    }
+
 def get_attribute_info(obj):
     """Get information about object attributes."""
     attributes = {}
@@ -181,17 +944,9 @@ def get_attribute_info(obj):
         if isinstance(obj, dict):
             for key, value in obj.items():
                 try:
-                    attributes[str(key)] = {
-                        'type': type(value).__name__,
-                        'category': get_object_category(value),
-                        'value': str(value) if not isinstance(value, (dict, list, tuple, set)) else f"{type(value).__name__}({len(value)} items)"
-                    }
+                    attributes[str(key)] = get_attribute_entry(value)
                 except Exception as e:
-                    attributes[str(key)] = {
-                        'type': 'error',
-                        'error_type': type(e).__name__,
-                        'error': str(e)
-                    }
+                    attributes[str(key)] = get_error_entry(e)
         else:
             # For non-dictionaries, use dir() as before
             show_private = isinstance(obj, dict)
@@ -200,21 +955,143 @@ def get_attribute_info(obj):
                     try:
                         attr = getattr(obj, name)
                         if not callable(attr):
-                            attributes[name] = {
-                                'type': type(attr).__name__,
-                                'category': get_object_category(attr),
-                                'value': str(attr) if not isinstance(attr, (dict, list, tuple, set)) else f"{type(attr).__name__}({len(attr)} items)"
-                            }
+                            attributes[name] = get_attribute_entry(attr)
                     except Exception as e:
-                        attributes[name] = {
-                            'type': 'error',
-                            'error_type': type(e).__name__,
-                            'error': str(e)
-                        }
+                        attributes[name] = get_error_entry(e)
     except Exception as e:
         print(f"Error getting attributes: {e}")
     return attributes
 
+def get_member_names(obj):
+    """Split the member names of an object into attribute and method names.
+
+    Members are classified with inspect.getattr_static, so no property,
+    descriptor or __getattr__ hook runs and no value is rendered.
+    """
+    start = time.perf_counter()
+    attribute_names = []
+    method_names = []
+    if isinstance(obj, dict):
+        # Dictionary items are shown as attributes, every dict method is shown
+        attribute_names = obj.keys()
+        method_names = [name for name in dir(obj) if callable(getattr(obj, name, None))]
+        agent_stats.record("object_info", "dir", time.perf_counter() - start)
+        return attribute_names, method_names
+
+    for name in dir(obj):
+        if name.startswith('_'):
+            continue
+        try:
+            static = inspect.getattr_static(obj, name)
+        except AttributeError:
+            attribute_names.append(name)
+            continue
+        if callable(static) or isinstance(static, (staticmethod, classmethod)):
+            method_names.append(name)
+        else:
+            attribute_names.append(name)
+    agent_stats.record("object_info", "dir", time.perf_counter() - start)
+    return attribute_names, method_names
+
+class MemberNameCache:
+    """Member names of recently inspected expressions, so paging an object does not list it again.
+
+    Summaries store the names, pages read them. Entries are keyed by
+    session and expression, only hit while the expression still resolves
+    to the same object and expire after MEMBER_NAMES_TTL, so members
+    added since are picked up soon after.
+    """
+    def __init__(self, maxsize=MEMBER_NAMES_CACHE_SIZE, ttl=MEMBER_NAMES_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, session_id, expression, obj, refresh=False):
+        """Get the attribute and method names of obj, listing them unless a fresh entry exists or refresh is set."""
+        key = (session_id, expression)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if not refresh and entry is not None and entry[0] is obj and entry[1] > now:
+                self.entries.move_to_end(key)
+                return entry[2]
+        names = get_member_names(obj)
+        with self.lock:
+            self.entries[key] = (obj, now + self.ttl, names)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return names
+    
+    def drop_session(self, session_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == session_id]:
+                del self.entries[key]
+
+member_names_cache = MemberNameCache()
+
+def get_object_summary(obj, max_names=MAX_SUMMARY_NAMES, member_names=None):
+    """Get a cheap summary of a Python object: names, categories and counts only."""
+    try:
+        category = get_object_category(obj)
+        attribute_names, method_names = member_names or get_member_names(obj)
+        
+        try:
+            str_val = value_renderer.render(obj)
+        except Exception as e:
+            str_val = f"<Error getting string representation: {str(e)}>"
+
+        return {
+            'type': type(obj).__name__,
+            'category': category,
+            'value': str_val,
+            'metadata': get_object_metadata(obj, category),
+            'attribute_count': len(attribute_names),
+            'method_count': len(method_names),
+            'attribute_names': [str(name) for name in itertools.islice(attribute_names, max_names)],
+            'method_names': list(itertools.islice(method_names, max_names)),
+            'names_truncated': max(len(attribute_names), len(method_names)) > max_names
+        }
+    except Exception as e:
+        return get_error_entry(e)
+
+def get_object_page(obj, section, offset=0, limit=DEFAULT_PAGE_SIZE, member_names=None):
+    """Get one page of attribute or method entries of a Python object."""
+    if section not in ('attributes', 'methods'):
+        return get_error_entry(ValueError(f"Unknown section: {section}"))
+    offset = max(0, int(offset))
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    
+    attribute_names, method_names = member_names or get_member_names(obj)
+    names = attribute_names if section == 'attributes' else method_names
+    items = {}
+    if isinstance(obj, dict) and section == 'attributes':
+        for key, value in itertools.islice(obj.items(), offset, offset + limit):
+            try:
+                items[str(key)] = get_attribute_entry(value)
+            except Exception as e:
+                items[str(key)] = get_error_entry(e)
+    else:
+        fingerprint = get_namespace_fingerprint(get_metadata_owner(obj)) if section == 'methods' else None
+        for name in itertools.islice(names, offset, offset + limit):
+            try:
+                attr = getattr(obj, name)
+                if callable(attr):
+                    items[name] = get_callable_entry(obj, name, attr, fingerprint)
+                else:
+                    items[name] = get_attribute_entry(attr)
+            except Exception as e:
+                items[name] = get_error_entry(e)
+    
+    return {
+        'section': section,
+        'offset': offset,
+        'limit': limit,
+        'total': len(names),
+        'items': items
+    }
+
 def get_object_category(obj):
     """Get the category of a Python object."""
     if inspect.ismodule(obj):
@@ -252,16 +1129,16 @@ def get_object_metadata(obj, category):
         else:
             # For instances, try to get the file of their class
             metadata['file'] = inspect.getfile(obj.__class__) if hasattr(obj, '__class__') else None
-    except (TypeError, ValueError):
+    except (TypeError, ValueError, OSError):
         metadata['file'] = None
     
     if category == 'sequence':
         metadata['length'] = len(obj)
-        metadata['element_types'] = list(set(type(x).__name__ for x in obj[:5]))  # Sample first 5 elements
+        metadata['element_types'] = list(set(type(x).__name__ for x in itertools.islice(obj, 5)))  # Sample first 5 elements
     elif category == 'dictionary':
         metadata['length'] = len(obj)
-        metadata['key_types'] = list(set(type(k).__name__ for k in list(obj.keys())[:5]))
-        metadata['value_types'] = list(set(type(v).__name__ for v in list(obj.values())[:5]))
+        metadata['key_types'] = list(set(type(k).__name__ for k in itertools.islice(obj.keys(), 5)))
+        metadata['value_types'] = list(set(type(v).__name__ for v in itertools.islice(obj.values(), 5)))
     
     return metadata
 
@@ -276,20 +1153,27 @@ def get_object_info(obj, path=''):
         category = get_object_category(obj)
         
         # Get string representation safely
+        start = time.perf_counter()
         try:
-            str_val = str(obj)
-            if len(str_val) > 1000:  # Truncate long strings
-                str_val = str_val[:1000] + '...'
+            str_val = value_renderer.render(obj)
         except Exception as e:
             str_val = f"<Error getting string representation: {str(e)}>"
+        rendered = time.perf_counter()
 
         # Get metadata based on category
         metadata = get_object_metadata(obj, category)
+        described = time.perf_counter()
         
         # Get attributes and methods
         attributes = get_attribute_info(obj) if category != 'primitive' else {}
+        listed = time.perf_counter()
         methods = get_callable_info(obj) if category != 'primitive' else {}
         
+        agent_stats.record("object_info", "repr", rendered - start)
+        agent_stats.record("object_info", "metadata", described - rendered)
+        agent_stats.record("object_info", "attributes", listed - described)
+        agent_stats.record("object_info", "methods", time.perf_counter() - listed)
+        
         return {
             'type': type_name,
             'category': category,
@@ -305,55 +1189,1258 @@ def get_object_info(obj, path=''):
             'error': str(e)
         }
 
-def execute_code(code, globals_dict, output_queue):
-    # Create a local writer that uses the queue
-    class QueueWriter:
-        def __init__(self, queue):
-            self.queue = queue
-            self.buffer = ""
-        
-        def write(self, data):
-            if data:
-                self.buffer += data
-                if '\n' in self.buffer:
-                    lines = self.buffer.split('\n')
-                    self.buffer = lines[-1]
-                    
-                    for line in lines[:-1]:
-                        if line:
-                            self.queue.put({
-                                "type": "output",
-                                "data": line + '\n'
-                            })
+def get_fingerprint(entry):
+    """Get a short hash of a member entry, it changes whenever the entry's type or rendering does.
+
+    Uses hash() instead of serializing the entry: strings cache their
+    hash, so the doc and source strings shared through the callable
+    cache are only hashed once.
+    """
+    if entry.get('type') == 'method':
+        fields = (entry['method_type'], entry['callable_type'], entry['is_runnable'], entry['is_property'],
+                  entry['signature'], entry['return_type'], entry['doc'], entry['source'], entry['source_file'],
+                  entry['is_async'], entry['is_generator'], *entry['decorators'])
+    else:
+        # Attribute and error entries only hold strings
+        fields = tuple(entry.values())
+    return '%016x' % (hash(fields) & 0xFFFFFFFFFFFFFFFF)
+
+def add_fingerprints(info):
+    """Add per-member fingerprints and an object version to a get_object_info result."""
+    fingerprints = {section: {name: get_fingerprint(entry) for name, entry in info.get(section, {}).items()} for section in ('attributes', 'methods')}
+    version = hashlib.blake2b(digest_size=8)
+    version.update(json.dumps([info.get('type'), info.get('value'), info.get('metadata')], default=str).encode("utf-8"))
+    for section, members in fingerprints.items():
+        version.update("".join(f"{section}\0{name}\0{fingerprint}\n" for name, fingerprint in members.items()).encode("utf-8", "replace"))
+    info['fingerprints'] = fingerprints
+    info['version'] = version.hexdigest()
+    return info
+
+def get_object_delta(info, old_fingerprints, since):
+    """Reduce a fingerprinted get_object_info result to the members that changed since an earlier version."""
+    delta = {key: info[key] for key in ('type', 'category', 'value', 'metadata', 'version')}
+    delta.update({'since': since, 'added': {}, 'changed': {}, 'removed': {}, 'fingerprints': {}})
+    for section in ('attributes', 'methods'):
+        entries = info[section]
+        new = info['fingerprints'][section]
+        old = old_fingerprints.get(section, {})
+        delta['added'][section] = {name: entries[name] for name in new if name not in old}
+        delta['changed'][section] = {name: entries[name] for name in new if name in old and old[name] != new[name]}
+        delta['removed'][section] = [name for name in old if name not in new]
+        delta['fingerprints'][section] = {name: new[name] for name in itertools.chain(delta['added'][section], delta['changed'][section])}
+    return delta
+
+class InspectHistory:
+    """Member fingerprints of the last few versions of recently inspected expressions.
+
+    Only fingerprints are kept, never the inspected objects or their
+    rendered entries.
+    """
+    def __init__(self, maxsize=INSPECT_HISTORY_SIZE, versions=INSPECT_HISTORY_VERSIONS):
+        self.maxsize = maxsize
+        self.versions = versions
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, session_id, expression, version):
+        with self.lock:
+            versions = self.entries.get((session_id, expression))
+            return versions.get(version) if versions else None
+    
+    def put(self, session_id, expression, version, fingerprints):
+        with self.lock:
+            key = (session_id, expression)
+            versions = self.entries.get(key)
+            if versions is None:
+                versions = self.entries[key] = OrderedDict()
+            versions[version] = fingerprints
+            versions.move_to_end(version)
+            self.entries.move_to_end(key)
+            while len(versions) > self.versions:
+                versions.popitem(last=False)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+    
+    def drop_session(self, session_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == session_id]:
+                del self.entries[key]
+
+inspect_history = InspectHistory()
+
+class Session:
+    """A REPL session with its own globals namespace."""
+    def __init__(self, session_id):
+        self.id = session_id
+        self.globals = {
+            "__name__": "__console__",
+            "__builtins__": builtins,
+            "sys": sys
+        }
+
+# Sessions by id, kept across reconnects of the agent
+sessions = {}
+sessions_lock = threading.Lock()
+
+def get_session(session_id):
+    """Get the session with the given id, creating it on first use."""
+    session_id = session_id or DEFAULT_SESSION
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = Session(session_id)
+        return session
+
+def close_session(session_id):
+    with sessions_lock:
+        sessions.pop(session_id or DEFAULT_SESSION, None)
+    inspect_history.drop_session(session_id)
+    member_names_cache.drop_session(session_id)
+
+def tag_session(message, session_id, request_id=None):
+    """Tag a message with the session it belongs to and the request it answers, if any."""
+    if session_id:
+        message["session"] = session_id
+    if request_id is not None:
+        message["request_id"] = request_id
+    return message
+
+class QueueWriter:
+    """Line-buffered writer that queues one output chunk per write.
+
+    Text after the last newline is held back until a line ends or
+    OUTPUT_BATCH_BYTES are pending. The queue is bounded: a producer that
+    outruns the socket blocks, and after OUTPUT_PUT_TIMEOUT its output is
+    dropped and reported instead of growing the queue without bound.
+    """
+    def __init__(self, queue, session_id=None):
+        self.queue = queue
+        self.session_id = session_id
+        self.pending = []
+        self.pending_size = 0
+        self.dropped = 0
+    
+    def put(self, data):
+        if self.dropped:
+            data = f"[{self.dropped} bytes of output dropped]\n" + data
+        try:
+            self.queue.put(tag_session({"type": "output", "data": data}, self.session_id), timeout=OUTPUT_PUT_TIMEOUT)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += len(data)
+    
+    def write(self, data):
+        if data:
+            end = data.rfind('\n') + 1
+            if end:
+                # Queue every complete line at once, keep the remainder buffered
+                self.pending.append(data[:end])
+                complete = "".join(self.pending)
+                self.pending = [data[end:]] if end < len(data) else []
+                self.pending_size = len(data) - end
+                self.put(complete)
+            else:
+                self.pending.append(data)
+                self.pending_size += len(data)
+                if self.pending_size >= OUTPUT_BATCH_BYTES:
+                    # A line that never ends is queued in batches, under the same backpressure
+                    self.flush()
+        return len(data)
+    
+    def flush(self):
+        if self.pending:
+            data = "".join(self.pending)
+            self.pending = []
+            self.pending_size = 0
+            self.put(data)
+
+def send_output(output_queue, writer, max_bytes=OUTPUT_BATCH_BYTES):
+    """Drain pending output, coalescing consecutive chunks of a session into as few output frames as possible.
+
+    Only what is queued on entry is taken, so a producer that keeps the
+    queue busy cannot hold the loop here while nothing gets written.
+    """
+    pending = output_queue.qsize()
+    agent_stats.record_gauge("output_queue_depth", pending)
+    chunks = []
+    size = 0
+    session_id = None
+    for _ in range(pending):
+        try:
+            output = output_queue.get_nowait()
+        except queue.Empty:
+            break
+        if chunks and (output.get("type") != "output" or output.get("session") != session_id or size >= max_bytes):
+            writer.send(tag_session({"type": "output", "data": "".join(chunks)}, session_id))
+            chunks, size = [], 0
+        if output.get("type") != "output":
+            writer.send(output)
+            continue
+        session_id = output.get("session")
+        chunks.append(output["data"])
+        size += len(output["data"])
+    if chunks:
+        writer.send(tag_session({"type": "output", "data": "".join(chunks)}, session_id))
+
+# Writer receiving the output of the execution running in the current context
+current_output = contextvars.ContextVar("current_output", default=None)
+
+class OutputRouter:
+    """Stand-in for sys.stdout/sys.stderr that routes writes to the current execution's writer.
+
+    Installed once for the whole process. Writes made outside a REPL
+    execution, e.g. by the host application's own threads, go to the
+    original stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+    
+    def write(self, data):
+        writer = current_output.get()
+        if writer is not None:
+            return writer.write(data)
+        if self.stream is None:
             return len(data)
-        
-        def flush(self):
-            if self.buffer:
-                self.queue.put({
-                    "type": "output",
-                    "data": self.buffer
-                })
-                self.buffer = ""
-    
-    # Create local stdout/stderr redirectors
-    writer = QueueWriter(output_queue)
-    old_stdout = sys.stdout
-    old_stderr = sys.stderr
-    sys.stdout = writer
-    sys.stderr = writer
+        return self.stream.write(data)
+    
+    def flush(self):
+        writer = current_output.get()
+        if writer is not None:
+            writer.flush()
+        elif self.stream is not None:
+            self.stream.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def install_output_router():
+    """Route sys.stdout and sys.stderr through an OutputRouter, unless that is already done."""
+    if not isinstance(sys.stdout, OutputRouter):
+        sys.stdout = OutputRouter(sys.stdout)
+    if not isinstance(sys.stderr, OutputRouter):
+        sys.stderr = OutputRouter(sys.stderr)
+
+@functools.lru_cache(maxsize=CODE_CACHE_SIZE)
+def compile_cached(source, mode, filename="<repl>"):
+    """Compile source code, reusing the code object of a recent identical compile."""
+    return compile(source, filename, mode)
+
+def execute_code(code, globals_dict, output_queue, session_id=None, mode="single"):
+    # Route this thread's stdout/stderr to the execution's own writer
+    install_output_router()
+    writer = QueueWriter(output_queue, session_id)
+    token = current_output.set(writer)
     
     try:
-        compiled = compile(code, "<repl>", "single")
+        start = time.perf_counter()
+        # Large one-off scripts are not worth keeping
+        compiled = compile_cached(code, mode) if len(code) <= CODE_CACHE_MAX_SOURCE else compile(code, "<repl>", mode)
+        compiled_at = time.perf_counter()
+        agent_stats.record("execute_code", "compile", compiled_at - start)
+        if mode == "eval":
+            value = eval(compiled, globals_dict, globals_dict)
+            agent_stats.record("execute_code", "exec", time.perf_counter() - compiled_at)
+            rendered = value_renderer.render(value)
+            return {"type": "success", "message": rendered, "value": rendered, "value_type": type(value).__name__}
         exec(compiled, globals_dict, globals_dict)
+        agent_stats.record("execute_code", "exec", time.perf_counter() - compiled_at)
         return {"type": "success", "message": "Code executed successfully"}
     except Exception as e:
         err = traceback.format_exc()
         return {"type": "error", "error": err}
+    except JobCancelled:
+        return {"type": "error", "error": "Execution cancelled"}
     finally:
-        sys.stdout = old_stdout
-        sys.stderr = old_stderr
+        current_output.reset(token)
         writer.flush()
 
+class JobCancelled(BaseException):
+    """Raised asynchronously in a worker thread to stop a running job."""
+
+def raise_in_thread(thread_id, exc_type):
+    """Schedule an exception in another thread; pass None to clear a pending one."""
+    exc = ctypes.py_object(exc_type) if exc_type is not None else None
+    return ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), exc)
+
+class Job:
+    """A piece of REPL code submitted to the executor."""
+    def __init__(self, job_id, code, session_id, timeout, mode="single"):
+        self.id = job_id
+        self.code = code
+        self.mode = mode
+        self.session_id = session_id
+        self.timeout = timeout
+        self.status = "queued"
+        self.cancel_reason = None
+        self.thread_id = None
+        self.future = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+    
+    def to_dict(self):
+        end = self.finished or time.time()
+        return {
+            "job_id": self.id,
+            "session": self.session_id,
+            "status": self.status,
+            "code": self.code if len(self.code) <= 200 else self.code[:200] + '...',
+            "mode": self.mode,
+            "timeout": self.timeout,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "duration": end - self.started if self.started else None
+        }
+    
+    def get_cancel_error(self):
+        """Get the error reported for a job stopped by a cancel or its timeout."""
+        if self.status == "timeout":
+            return f"Execution timed out after {self.timeout}s"
+        return "Execution cancelled"
+
+class JobRegistry:
+    """Table of submitted jobs, keeping the most recent finished ones for status queries."""
+    def __init__(self, history_size=JOB_HISTORY_SIZE):
+        self.history_size = history_size
+        self.jobs = OrderedDict()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+    
+    def create(self, code, session_id=None, timeout=None, mode="single"):
+        with self.lock:
+            job = Job(next(self.ids), code, session_id, timeout, mode)
+            self.jobs[job.id] = job
+            finished = [job_id for job_id, j in self.jobs.items() if j.finished]
+            for job_id in finished[:max(0, len(finished) - self.history_size)]:
+                del self.jobs[job_id]
+            return job
+    
+    def get(self, job_id, session_id=None):
+        """Get a job of the given session, jobs of other sessions are not visible."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job if job is not None and job.session_id == session_id else None
+    
+    def list(self, session_id=None):
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values() if job.session_id == session_id]
+    
+    def cancel(self, job_id, session_id=None, reason="cancelled"):
+        """Cancel a queued job, or stop a running one by raising JobCancelled in its thread."""
+        job = self.get(job_id, session_id)
+        if job is None:
+            return None
+        with job.lock:
+            if job.status == "queued" and job.future is not None:
+                # Set the outcome first, the future's done callback runs inside cancel()
+                job.status = reason
+                job.finished = time.time()
+                if not job.future.cancel():
+                    # A worker already took the job but has not started it, run_job stops it on entry
+                    job.status = "queued"
+                    job.finished = None
+                    job.cancel_reason = job.cancel_reason or reason
+            elif job.status == "running" and job.thread_id is not None and job.cancel_reason is None:
+                job.cancel_reason = reason
+                raise_in_thread(job.thread_id, JobCancelled)
+        return job
+
+jobs = JobRegistry()
+
+def run_job(job, globals_dict, output_queue):
+    """Run a job's code in the current worker thread and record its outcome."""
+    with job.lock:
+        if job.cancel_reason:
+            # Cancelled while the future was being handed to this worker
+            job.status = job.cancel_reason
+            job.finished = time.time()
+            return {"type": "error", "error": job.get_cancel_error(), "job_id": job.id}
+    result = {"type": "error", "error": "Execution cancelled"}
+    try:
+        with job.lock:
+            job.status = "running"
+            job.thread_id = threading.get_ident()
+            job.started = time.time()
+        agent_stats.record("execute_code", "queue", job.started - job.submitted)
+        agent_stats.worker_started()
+        try:
+            result = execute_code(job.code, globals_dict, output_queue, job.session_id, job.mode)
+        finally:
+            agent_stats.worker_finished()
+    except JobCancelled:
+        pass
+    finally:
+        with job.lock:
+            if job.cancel_reason:
+                # The cancel may still be pending if the code finished first
+                raise_in_thread(job.thread_id, None)
+            job.thread_id = None
+            job.finished = time.time()
+            job.status = job.cancel_reason or ("done" if result.get("type") == "success" else "error")
+    
+    if job.status == "timeout":
+        result = {"type": "error", "error": job.get_cancel_error()}
+    result["job_id"] = job.id
+    return result
+
+class Watch:
+    """An expression evaluated on a timer whose rendered value is pushed when it changes.
+
+    An evaluation that runs longer than WATCH_TIME_BUDGET is interrupted
+    like a cancelled job and the watch is disabled.
+    """
+    def __init__(self, watch_id, expression, code, globals_dict, session_id, interval):
+        self.id = watch_id
+        self.expression = expression
+        self.code = code
+        self.globals = globals_dict
+        self.session_id = session_id
+        self.interval = interval
+        self.last = None
+        self.task = None
+        self.disabled = False
+        self.thread_id = None
+        self.started = None
+        self.stopping = False
+        self.executor = None
+        self.lock = threading.Lock()
+    
+    def evaluate(self):
+        """Evaluate the expression and render its value, runs in a watch thread."""
+        with self.lock:
+            if self.stopping:
+                return None
+            self.thread_id = threading.get_ident()
+            self.started = time.perf_counter()
+        try:
+            value = eval(self.code, self.globals, self.globals)
+            return {
+                "value": value_renderer.render(value),
+                "value_type": type(value).__name__,
+                "category": get_object_category(value)
+            }
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+        except JobCancelled:
+            return None
+        finally:
+            with self.lock:
+                if self.stopping:
+                    # The interrupt may still be pending if the evaluation finished first
+                    raise_in_thread(self.thread_id, None)
+                self.thread_id = None
+                self.started = None
+    
+    def stop(self):
+        """Interrupt the running evaluation, if any, and keep new ones from starting.
+
+        Returns True if an evaluation was running.
+        """
+        with self.lock:
+            if self.stopping or self.thread_id is None:
+                self.stopping = True
+                return False
+            self.stopping = True
+            raise_in_thread(self.thread_id, JobCancelled)
+            return True
+    
+    def is_over_budget(self):
+        started = self.started
+        return started is not None and time.perf_counter() - started > WATCH_TIME_BUDGET
+    
+    async def run(self, registry, writer):
+        # One evaluation at a time, so changes between two evaluations coalesce into one update
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                self.executor = registry.executor
+                future = loop.run_in_executor(self.executor, self.evaluate)
+                # Time spent queued behind other watches does not count against the budget
+                while not (await asyncio.wait({future}, timeout=WATCH_TIME_BUDGET))[0]:
+                    if self.is_over_budget():
+                        registry.interrupt(self)
+                        self.disabled = True
+                        break
+                if future.cancelled():
+                    # Dropped from a pool held by a stuck evaluation, retry on the new one
+                    continue
+                if self.disabled:
+                    state = {"error": f"Disabled: evaluation took longer than {WATCH_TIME_BUDGET}s", "disabled": True}
+                else:
+                    state = future.result()
+                    if state is None:
+                        return
+                if state != self.last:
+                    self.last = state
+                    await writer.drain()
+                    update = {"type": "watch_update", "watch_id": self.id, "expression": self.expression, "time": time.time(), **state}
+                    writer.send(tag_session(update, self.session_id))
+                if self.disabled:
+                    return
+                await asyncio.sleep(self.interval)
+        finally:
+            self.stop()
+    
+    def to_dict(self):
+        return {
+            "watch_id": self.id,
+            "expression": self.expression,
+            "interval": self.interval,
+            "disabled": self.disabled
+        }
+
+class WatchRegistry:
+    """Watches of all sessions, only used from the event loop.
+
+    Watches are evaluated on their own small thread pool, so a slow or
+    stuck watch never takes a REPL worker. An interrupted evaluation that
+    is still running a budget later, e.g. blocked in a C call, keeps its
+    thread; the other watches move to a fresh pool.
+    """
+    def __init__(self, workers=WATCH_WORKERS):
+        self.watches = {}
+        self.ids = itertools.count(1)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="watch")
+    
+    def add(self, expression, globals_dict, session_id, interval, writer):
+        if sum(1 for watch in self.watches.values() if watch.session_id == session_id) >= MAX_WATCHES:
+            raise ValueError(f"At most {MAX_WATCHES} watches per session")
+        code = compile_cached(expression, "eval", "<watch>")
+        watch = Watch(next(self.ids), expression, code, globals_dict, session_id, interval)
+        watch.task = asyncio.get_running_loop().create_task(watch.run(self, writer))
+        self.watches[watch.id] = watch
+        return watch
+    
+    def remove(self, watch_id, session_id):
+        watch = self.watches.get(watch_id)
+        if watch is None or watch.session_id != session_id:
+            return None
+        del self.watches[watch_id]
+        watch.task.cancel()
+        self.interrupt(watch)
+        return watch
+    
+    def interrupt(self, watch):
+        """Stop a watch's evaluation, replacing the thread pool if the evaluation does not end."""
+        if watch.stop():
+            asyncio.get_running_loop().call_later(WATCH_TIME_BUDGET, self.check_stuck, watch)
+    
+    def check_stuck(self, watch):
+        if watch.thread_id is not None and watch.executor is self.executor:
+            stuck, self.executor = self.executor, ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="watch")
+            # Evaluations still queued there are cancelled and resubmitted by their watches
+            stuck.shutdown(wait=False, cancel_futures=True)
+    
+    def list(self, session_id):
+        return [watch.to_dict() for watch in self.watches.values() if watch.session_id == session_id]
+    
+    def drop_session(self, session_id):
+        for watch_id in [watch.id for watch in self.watches.values() if watch.session_id == session_id]:
+            self.remove(watch_id, session_id)
+    
+    def clear(self):
+        for watch in self.watches.values():
+            watch.task.cancel()
+            self.interrupt(watch)
+        self.watches.clear()
+
+watches = WatchRegistry()
+
+def get_frame_label(code, labels):
+    """Get the flamegraph label of a code object, cached per profile."""
+    label = labels.get(code)
+    if label is None:
+        name = getattr(code, 'co_qualname', code.co_name)
+        label = labels[code] = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+def sample_stacks(duration, rate, exclude=()):
+    """Sample the stacks of all threads and fold them into a collapsed-stack tree.
+
+    Every 1/rate seconds sys._current_frames() is read and each thread's
+    stack is added to a tree rooted at the thread name, so each node's
+    value is the number of samples it was on the stack.
+    """
+    exclude = set(exclude) | {threading.get_ident()}
+    interval = 1.0 / rate
+    labels = {}
+    root = {'name': 'all', 'value': 0, 'self': 0, 'children': {}}
+    thread_names = {}
+    samples = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    next_sample = start
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        if now < next_sample:
+            time.sleep(next_sample - now)
+        next_sample += interval
+        
+        frames = sys._current_frames()
+        if any(thread_id not in thread_names for thread_id in frames):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        samples += 1
+        for thread_id, frame in frames.items():
+            if thread_id in exclude:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(get_frame_label(frame.f_code, labels))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+            
+            node = root
+            node['value'] += 1
+            for label in reversed(stack):
+                child = node['children'].get(label)
+                if child is None:
+                    child = node['children'][label] = {'name': label, 'value': 0, 'self': 0, 'children': {}}
+                child['value'] += 1
+                node = child
+            node['self'] += 1
+        del frames
+    
+    def to_list(node):
+        node['children'] = [to_list(child) for child in sorted(node['children'].values(), key=lambda c: -c['value'])]
+        return node
+    
+    return {
+        'duration': time.perf_counter() - start,
+        'rate': rate,
+        'samples': samples,
+        'tree': to_list(root)
+    }
+
+def start_profile(cmd, writer):
+    """Run the sampler in its own thread and send the result when it is done."""
+    duration = min(max(float(cmd.get("duration", 5)), 0.1), MAX_PROFILE_DURATION)
+    rate = min(max(float(cmd.get("rate", 100)), 1), MAX_PROFILE_RATE)
+    session_id = cmd.get("session")
+    # The agent's own event loop thread is left out unless asked for
+    exclude = () if cmd.get("include_agent") else (threading.get_ident(),)
+    
+    def run():
+        try:
+            result = {"type": "profile_result", "data": sample_stacks(duration, rate, exclude)}
+        except Exception as e:
+            result = {"type": "error", "error": f"Profiling failed: {e}"}
+        writer.send(tag_session(result, session_id))
+    
+    threading.Thread(target=run, name="webshell-profiler", daemon=True).start()
+    return {"type": "profile_started", "duration": duration, "rate": rate}
+
+def get_type_expression(cls):
+    """Get an inspect expression for a class, or None if it can't be reached from its module."""
+    module_name = getattr(cls, '__module__', None)
+    qualname = getattr(cls, '__qualname__', None)
+    if not isinstance(module_name, str) or not isinstance(qualname, str):
+        return None
+    obj = sys.modules.get(module_name)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name, None)
+    if obj is not cls:
+        return None
+    return f"sys.modules['{module_name}'].{qualname}"
+
+class HeapCensus:
+    """Object counts and shallow sizes per type, added a chunk of objects at a time.
+
+    Only the per-type totals are kept, never the objects themselves.
+    """
+    def __init__(self):
+        self.types = {}
+        self.scanned = 0
+        self.size = 0
+    
+    def add(self, objects):
+        types = self.types
+        for obj in objects:
+            cls = type(obj)
+            entry = types.get(cls)
+            if entry is None:
+                entry = types[cls] = [0, 0, get_object_category(obj)]
+            try:
+                size = sys.getsizeof(obj)
+            except Exception:
+                size = 0
+            entry[0] += 1
+            entry[1] += size
+            self.size += size
+        self.scanned += len(objects)
+    
+    def get_top(self, limit=HEAP_TOP_N, sort="size"):
+        index = 0 if sort == "count" else 1
+        top = sorted(self.types.items(), key=lambda item: -item[1][index])[:limit]
+        return [{
+            'name': getattr(cls, '__qualname__', cls.__name__),
+            'module': getattr(cls, '__module__', None),
+            'category': category,
+            'count': count,
+            'size': size,
+            'expression': get_type_expression(cls)
+        } for cls, (count, size, category) in top]
+
+# Census and graph walks running on the loop, referenced until they finish
+background_tasks = set()
+heap_census_ids = itertools.count(1)
+
+async def run_heap_census(writer, session_id, limit=HEAP_TOP_N, sort="size", request_id=None):
+    """Walk the gc generations in chunks, streaming partial results as heap_census messages.
+
+    The loop gets control back after every chunk, so objects may move
+    between generations while the census runs and the totals are
+    approximate. Only objects tracked by the garbage collector are seen;
+    tracemalloc covers the rest. The final result or error carries the
+    request id, partial ones are routed by session.
+    """
+    census = HeapCensus()
+    census_id = next(heap_census_ids)
+    
+    async def report(generation, done=False):
+        await writer.drain()
+        writer.send(tag_session({
+            "type": "heap_census",
+            "id": census_id,
+            "done": done,
+            "generation": generation,
+            "scanned": census.scanned,
+            "size": census.size,
+            "type_count": len(census.types),
+            "types": census.get_top(limit, sort)
+        }, session_id, request_id if done else None))
+    
+    try:
+        last_report = time.perf_counter()
+        # Oldest first, that is where most long-lived objects are
+        for generation in (2, 1, 0):
+            objects = gc.get_objects(generation)
+            try:
+                for start in range(0, len(objects), HEAP_CHUNK_SIZE):
+                    census.add(objects[start:start + HEAP_CHUNK_SIZE])
+                    await asyncio.sleep(0)
+                    if time.perf_counter() - last_report >= HEAP_PROGRESS_INTERVAL:
+                        await report(generation)
+                        last_report = time.perf_counter()
+            finally:
+                del objects
+        await report(None, done=True)
+    except Exception as e:
+        writer.send(tag_session({"type": "error", "error": f"Heap census failed: {e}"}, session_id, request_id))
+
+def get_trace_entry(stat):
+    """Get the entry for a tracemalloc statistic or statistic diff grouped by line."""
+    frame = stat.traceback[0]
+    entry = {
+        'file': frame.filename,
+        'line': frame.lineno,
+        'source': linecache.getline(frame.filename, frame.lineno).strip(),
+        'size': stat.size,
+        'count': stat.count
+    }
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        entry['size_diff'] = stat.size_diff
+        entry['count_diff'] = stat.count_diff
+    return entry
+
+class HeapTracker:
+    """Controls tracemalloc and keeps the last few snapshots for diffing."""
+    def __init__(self, history=HEAP_SNAPSHOT_HISTORY):
+        self.history = history
+        self.snapshots = OrderedDict()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        # Allocations made by tracemalloc itself and the import machinery are noise
+        self.filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>")
+        ]
+    
+    def get_status(self):
+        current, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            snapshots = list(self.snapshots)
+        return {
+            "type": "heap_trace",
+            "tracing": tracemalloc.is_tracing(),
+            "frames": tracemalloc.get_traceback_limit(),
+            "current": current,
+            "peak": peak,
+            "overhead": tracemalloc.get_tracemalloc_memory(),
+            "snapshots": snapshots
+        }
+    
+    def start(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        return self.get_status()
+    
+    def stop(self):
+        tracemalloc.stop()
+        return self.get_status()
+    
+    def take_snapshot(self):
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not tracing, start it first")
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+        with self.lock:
+            snapshot_id = next(self.ids)
+            self.snapshots[snapshot_id] = snapshot
+            while len(self.snapshots) > self.history:
+                self.snapshots.popitem(last=False)
+        return snapshot_id, snapshot
+    
+    def get_snapshot(self, snapshot_id):
+        with self.lock:
+            snapshot = self.snapshots.get(snapshot_id)
+        if snapshot is None:
+            raise ValueError(f"Unknown snapshot: {snapshot_id}")
+        return snapshot
+    
+    def snapshot(self, limit=HEAP_TOP_N):
+        """Take a snapshot and report the lines holding the most memory."""
+        snapshot_id, snapshot = self.take_snapshot()
+        stats = snapshot.statistics('lineno')
+        return {
+            "type": "heap_snapshot",
+            "id": snapshot_id,
+            "size": sum(stat.size for stat in stats),
+            "count": sum(stat.count for stat in stats),
+            "lines": [get_trace_entry(stat) for stat in stats[:limit]]
+        }
+    
+    def diff(self, base_id, target_id=None, limit=HEAP_TOP_N):
+        """Compare two snapshots by line, taking a new one if no target is given."""
+        base = self.get_snapshot(int(base_id))
+        if target_id is None:
+            target_id, target = self.take_snapshot()
+        else:
+            target_id = int(target_id)
+            target = self.get_snapshot(target_id)
+        stats = target.compare_to(base, 'lineno')
+        return {
+            "type": "heap_diff",
+            "base": int(base_id),
+            "target": target_id,
+            "size_diff": sum(stat.size_diff for stat in stats),
+            "count_diff": sum(stat.count_diff for stat in stats),
+            "lines": [get_trace_entry(stat) for stat in stats[:limit]]
+        }
+
+heap_tracker = HeapTracker()
+
+def handle_heap_command(cmd, executor, writer):
+    """Run a heap action: census, trace_start, trace_stop, trace_status, snapshot or diff.
+
+    Census, snapshot and diff results are sent later, tagged with the
+    command's request id so the server can route them and forget it.
+    """
+    action = cmd.get("action", "census")
+    session_id = cmd.get("session")
+    request_id = cmd.get("request_id")
+    limit = min(max(int(cmd.get("limit", HEAP_TOP_N)), 1), MAX_PAGE_SIZE)
+    
+    if action == "census":
+        sort = "count" if cmd.get("sort") == "count" else "size"
+        task = asyncio.get_running_loop().create_task(run_heap_census(writer, session_id, limit, sort, request_id))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        return None
+    elif action == "trace_start":
+        return heap_tracker.start(min(max(int(cmd.get("frames", 1)), 1), 100))
+    elif action == "trace_stop":
+        return heap_tracker.stop()
+    elif action == "trace_status":
+        return heap_tracker.get_status()
+    elif action in ("snapshot", "diff"):
+        # Snapshots walk every trace, keep that off the event loop
+        if action == "snapshot":
+            future = executor.submit(heap_tracker.snapshot, limit)
+        else:
+            if cmd.get("base") is None:
+                return {"type": "error", "error": "No base snapshot provided"}
+            future = executor.submit(heap_tracker.diff, cmd.get("base"), cmd.get("target"), limit)
+        
+        def on_complete(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"type": "error", "error": str(e)}
+            writer.send(tag_session(result, session_id, request_id))
+        
+        future.add_done_callback(on_complete)
+        return None
+    else:
+        return {"type": "error", "error": f"Unknown heap action: {action}"}
+
+def get_graph_node(obj, depth):
+    """Get the d3 node of an object in an object graph."""
+    try:
+        label = value_renderer.render(obj, GRAPH_LABEL_LENGTH)
+    except Exception as e:
+        label = f"<{type(e).__name__}>"
+    try:
+        size = sys.getsizeof(obj)
+    except Exception:
+        size = None
+    return {
+        'id': str(id(obj)),
+        'type': type(obj).__qualname__,
+        'category': get_object_category(obj),
+        'label': label,
+        'depth': depth,
+        'size': size
+    }
+
+class ObjectGraph:
+    """Breadth-first walk over the referents or referrers of an object within node, edge, depth and time budgets.
+
+    Edges are kept once per pair of objects, however many references one
+    holds to the other. Walked objects are held in one list so their ids
+    stay unique while the walk runs. That list and the walk's own coroutines are left out
+    of the referrers found. Referrers are found with one chunked pass
+    over the gc-tracked objects per level rather than gc.get_referrers(),
+    which scans the whole heap for every object at once.
+    """
+    def __init__(self, root, direction, max_nodes, max_depth, time_budget):
+        self.direction = direction
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.deadline = time.perf_counter() + time_budget
+        self.held = [root]
+        self.index = {id(root): 0}
+        self.nodes = [get_graph_node(root, 0)]
+        self.edges = []
+        self.edge_keys = set()
+        self.max_edges = max_nodes * GRAPH_EDGES_PER_NODE
+        self.truncated = None
+    
+    def add_node(self, obj, depth):
+        """Add an object as a node, returns False if it was known and None if over the node budget."""
+        if id(obj) in self.index:
+            return False
+        if len(self.held) >= self.max_nodes:
+            self.truncated = "nodes"
+            return None
+        self.index[id(obj)] = len(self.held)
+        self.held.append(obj)
+        self.nodes.append(get_graph_node(obj, depth))
+        return True
+    
+    @property
+    def edge_count(self):
+        return len(self.edge_keys)
+    
+    def add_edge(self, source, target):
+        """Add an edge unless it is known, returns None if over the edge budget."""
+        key = (source, target)
+        if key in self.edge_keys:
+            return False
+        if len(self.edge_keys) >= self.max_edges:
+            self.truncated = "edges"
+            return None
+        self.edge_keys.add(key)
+        self.edges.append({'source': str(source), 'target': str(target)})
+        return True
+    
+    def take_batch(self):
+        nodes, edges = self.nodes, self.edges
+        self.nodes, self.edges = [], []
+        return nodes, edges
+    
+    def is_expandable(self, obj):
+        # Modules and classes reach most of the heap, they are shown but not walked through
+        return not (inspect.ismodule(obj) or inspect.isclass(obj))
+    
+    def is_over_time(self):
+        if time.perf_counter() >= self.deadline:
+            self.truncated = "time"
+        return self.truncated is not None
+    
+    async def walk_referents(self, flush):
+        frontier = [id(self.held[0])]
+        for depth in range(1, self.max_depth + 1):
+            next_frontier = []
+            for n, obj_id in enumerate(frontier, 1):
+                obj = self.held[self.index[obj_id]]
+                if depth > 1 and not self.is_expandable(obj):
+                    continue
+                # A single container can hold millions of references, so they count towards the chunk too
+                for i, referent in enumerate(gc.get_referents(obj), 1):
+                    added = self.add_node(referent, depth)
+                    if added is None or self.add_edge(obj_id, id(referent)) is None:
+                        return
+                    if added:
+                        next_frontier.append(id(referent))
+                    if i % GRAPH_CHUNK_SIZE == 0:
+                        if self.is_over_time():
+                            return
+                        await flush()
+                if n % GRAPH_CHUNK_SIZE == 0:
+                    if self.is_over_time():
+                        return
+                    await flush()
+            frontier = next_frontier
+            if not frontier:
+                return
+    
+    async def walk_referrers(self, flush):
+        internal_codes = {
+            ObjectGraph.walk_referrers.__code__,
+            ObjectGraph.run.__code__,
+            run_object_graph.__code__
+        }
+        frontier = {id(self.held[0])}
+        for depth in range(1, self.max_depth + 1):
+            next_frontier = set()
+            objects = gc.get_objects()
+            internal = {id(self.held), id(objects)}
+            try:
+                for start in range(0, len(objects), HEAP_CHUNK_SIZE):
+                    for candidate in objects[start:start + HEAP_CHUNK_SIZE]:
+                        if id(candidate) in internal:
+                            continue
+                        # Exact type check, getattr() could run arbitrary __getattr__ hooks
+                        if type(candidate) is types.CoroutineType and candidate.cr_code in internal_codes:
+                            continue
+                        for referent in gc.get_referents(candidate):
+                            if id(referent) not in frontier:
+                                continue
+                            added = self.add_node(candidate, depth)
+                            if added is None or self.add_edge(id(candidate), id(referent)) is None:
+                                return
+                            if added and self.is_expandable(candidate):
+                                next_frontier.add(id(candidate))
+                    candidate = referent = None
+                    if self.is_over_time():
+                        return
+                    await flush()
+            finally:
+                del objects
+            frontier = next_frontier
+            if not frontier:
+                return
+    
+    async def run(self, flush):
+        if self.direction == "referrers":
+            await self.walk_referrers(flush)
+        else:
+            await self.walk_referents(flush)
+
+graph_ids = itertools.count(1)
+
+async def run_object_graph(root, direction, max_nodes, max_depth, time_budget, writer, session_id, graph_id):
+    """Walk an object graph, streaming new nodes and edges as graph_batch messages."""
+    graph = ObjectGraph(root, direction, max_nodes, max_depth, time_budget)
+    root = None
+    
+    async def flush(done=False):
+        nodes, edges = graph.take_batch()
+        if not (nodes or edges or done):
+            # Still give the loop a turn between chunks
+            await asyncio.sleep(0)
+            return
+        await writer.drain()
+        batch = {"type": "graph_batch", "graph_id": graph_id, "direction": direction, "nodes": nodes, "edges": edges, "done": done}
+        if done:
+            batch.update({"node_count": len(graph.held), "edge_count": graph.edge_count, "truncated": graph.truncated})
+        writer.send(tag_session(batch, session_id))
+    
+    try:
+        await graph.run(flush)
+        await flush(done=True)
+    except Exception as e:
+        writer.send(tag_session({"type": "error", "error": f"Object graph failed: {e}"}, session_id))
+    finally:
+        graph.held.clear()
+
+def start_object_graph(cmd, obj, writer):
+    """Start walking the referents or referrers of an object in the background."""
+    direction = cmd.get("direction", "referents")
+    if direction not in ("referents", "referrers"):
+        return {"type": "error", "error": f"Unknown graph direction: {direction}"}
+    max_nodes = min(max(int(cmd.get("max_nodes", DEFAULT_GRAPH_NODES)), 1), MAX_GRAPH_NODES)
+    max_depth = min(max(int(cmd.get("max_depth", 2)), 1), MAX_GRAPH_DEPTH)
+    time_budget = min(max(float(cmd.get("time_budget", DEFAULT_GRAPH_TIME)), 0.01), MAX_GRAPH_TIME)
+    graph_id = next(graph_ids)
+    
+    task = asyncio.get_running_loop().create_task(
+        run_object_graph(obj, direction, max_nodes, max_depth, time_budget, writer, cmd.get("session"), graph_id))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return {
+        "type": "graph_started",
+        "graph_id": graph_id,
+        "expression": cmd.get("expression"),
+        "direction": direction,
+        "max_nodes": max_nodes,
+        "max_depth": max_depth,
+        "time_budget": time_budget
+    }
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def parse_inspect_path(expr):
+    """Split an inspect expression into attribute and key access parts, cached per expression."""
+    # Handle nested attribute access
+    parts = []
+    current = ""
+    in_brackets = False
+    for char in expr:
+        if char == '[':
+            if current:
+                parts.append(('attr', current))
+                current = ""
+            in_brackets = True
+        elif char == ']':
+            if current:
+                parts.append(('key', current.strip("'")))
+                current = ""
+            in_brackets = False
+        elif char == '.' and not in_brackets:
+            if current:
+                parts.append(('attr', current))
+                current = ""
+        else:
+            current += char
+    if current:
+        parts.append(('attr', current))
+    # A tuple, since cached results are shared
+    return tuple(parts)
+
+def resolve_inspect_part(obj, access_type, name):
+    """Apply one attribute or key access of an inspect expression."""
+    if access_type == 'key':
+        try:
+            return obj[name]  # Try dict-style access first
+        except (TypeError, KeyError):
+            return getattr(obj, name)  # Fall back to attribute access
+    return getattr(obj, name)
+
+def resolve_inspect_path(expr, globals_dict):
+    """Evaluate an inspect expression part by part."""
+    obj = None
+    for i, (access_type, name) in enumerate(parse_inspect_path(expr)):
+        if i == 0:
+            # First part is always evaluated in globals
+            obj = eval(compile_cached(name, "eval", "<inspect>"), globals_dict, globals_dict)
+        else:
+            # Subsequent parts are accessed as attributes or keys
+            obj = resolve_inspect_part(obj, access_type, name)
+    return obj
+
+class PathResolver:
+    """Resolves parsed inspect paths in one namespace, each shared prefix only once."""
+    def __init__(self, globals_dict):
+        self.globals = globals_dict
+        self.resolved = {}
+    
+    def resolve(self, parts):
+        parts = tuple(parts)
+        if not parts:
+            raise ValueError("No expression provided")
+        outcome = self.resolved.get(parts)
+        if outcome is None:
+            try:
+                if len(parts) == 1:
+                    outcome = (True, eval(compile_cached(parts[0][1], "eval", "<inspect>"), self.globals, self.globals))
+                else:
+                    outcome = (True, resolve_inspect_part(self.resolve(parts[:-1]), *parts[-1]))
+            except Exception as e:
+                outcome = (False, e)
+            # Failures are kept too, every path below a failing prefix reports the same error
+            self.resolved[parts] = outcome
+        resolved, value = outcome
+        if not resolved:
+            raise value
+        return value
+
+def get_child_paths(obj, expr, parts, limit):
+    """Get the expressions and parsed paths of an object's first attributes, or keys for a dict."""
+    attribute_names, _ = get_member_names(obj)
+    is_dict = isinstance(obj, dict)
+    children = []
+    for name in attribute_names:
+        if len(children) >= limit:
+            break
+        if is_dict:
+            # Only keys the path syntax can express
+            if not isinstance(name, str) or "]" in name or "'" in name:
+                continue
+            children.append((f"{expr}['{name}']", parts + (('key', name),)))
+        else:
+            children.append((f"{expr}.{name}", parts + (('attr', name),)))
+    return children
+
+def inspect_batch(cmd, globals_dict):
+    """Inspect a list of expressions, or a root and its attributes down to a depth, in one reply.
+
+    Paths are resolved through one PathResolver, so a prefix shared by
+    several expressions is evaluated once.
+    """
+    mode = cmd.get("mode", "summary")
+    if mode not in ("summary", "full", "page"):
+        return {"type": "error", "error": f"Unknown inspect mode: {mode}"}
+    limit = min(max(int(cmd.get("limit", DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    resolver = PathResolver(globals_dict)
+    results = []
+    
+    def describe(expr, parts, depth):
+        entry = {"expression": expr, "depth": depth}
+        try:
+            obj = resolver.resolve(parts)
+        except Exception as e:
+            entry["data"] = get_error_entry(e)
+            return entry, False, None
+        if mode == "summary":
+            entry["data"] = get_object_summary(obj)
+        elif mode == "full":
+            entry["data"] = get_object_info(obj)
+        else:
+            entry["data"] = get_object_page(obj, cmd.get("section", "attributes"), cmd.get("offset", 0), limit)
+        return entry, True, obj
+    
+    expressions = cmd.get("expressions")
+    if expressions is not None:
+        if not isinstance(expressions, list):
+            return {"type": "error", "error": "Expressions must be a list"}
+        for expr in expressions[:MAX_BATCH_SIZE]:
+            expr = str(expr)
+            entry, _, _ = describe(expr, parse_inspect_path(expr), 0)
+            results.append(entry)
+        truncated = len(expressions) > MAX_BATCH_SIZE
+    else:
+        root = str(cmd.get("root", ""))
+        if not root:
+            return {"type": "error", "error": "No expressions or root provided"}
+        max_depth = min(max(int(cmd.get("depth", 1)), 0), MAX_BATCH_DEPTH)
+        # Breadth first, so a truncated reply still holds the levels closest to the root
+        pending = collections.deque([(root, parse_inspect_path(root), 0)])
+        truncated = False
+        while pending:
+            expr, parts, depth = pending.popleft()
+            entry, resolved, obj = describe(expr, parts, depth)
+            results.append(entry)
+            if not resolved or depth >= max_depth:
+                continue
+            try:
+                children = get_child_paths(obj, expr, parts, limit)
+            except Exception as e:
+                entry["children_error"] = str(e)
+                continue
+            room = MAX_BATCH_SIZE - len(results) - len(pending)
+            if len(children) > room:
+                children = children[:max(room, 0)]
+                truncated = True
+            pending.extend((child_expr, child_parts, depth + 1) for child_expr, child_parts in children)
+    
+    return {"type": "inspect_batch", "mode": mode, "results": results, "truncated": truncated}
+
 def handle_command(cmd, globals_dict, executor, writer, sock, output_queue):
     try:
         if not isinstance(cmd, dict):
@@ -368,18 +2455,46 @@ def handle_command(cmd, globals_dict, executor, writer, sock, output_queue):
             if not code:
                 return {"type": "error", "error": "No code provided"}
             
+            mode = cmd.get("mode", "single")
+            if mode not in EXECUTION_MODES:
+                return {"type": "error", "error": f"Unknown execution mode: {mode}"}
+            
+            session_id = cmd.get("session")
+            timeout = cmd.get("timeout", DEFAULT_JOB_TIMEOUT)
+            job = jobs.create(code, session_id, float(timeout) if timeout else None, mode)
+            
             def on_complete(future):
+                # Results go through the output queue so they arrive after the output they follow.
+                # A cancel runs this on the event loop itself, so it must never wait for room.
                 try:
                     result = future.result()
-                    sock.sendall(json.dumps(result).encode("utf-8") + b"\n")
-                except Exception as e:
-                    error_response = {"type": "error", "error": str(e)}
-                    sock.sendall(json.dumps(error_response).encode("utf-8") + b"\n")
+                    output_queue.put_control(tag_session(result, session_id))
+                except BaseException as e:
+                    error = job.get_cancel_error() if future.cancelled() else str(e) or type(e).__name__
+                    error_response = {"type": "error", "error": error, "job_id": job.id}
+                    output_queue.put_control(tag_session(error_response, session_id))
+                output_queue.put_control(tag_session({"type": "job", **job.to_dict()}, session_id))
             
             # Submit code execution to thread pool without blocking
-            future = executor.submit(execute_code, code, globals_dict, output_queue)
-            future.add_done_callback(on_complete)
-            return None  # Don't return a response immediately
+            with job.lock:
+                job.future = executor.submit(run_job, job, globals_dict, output_queue)
+            job.future.add_done_callback(on_complete)
+            if job.timeout:
+                asyncio.get_running_loop().call_later(job.timeout, jobs.cancel, job.id, session_id, "timeout")
+            return {"type": "job", **job.to_dict()}
+        
+        elif cmd_type == "jobs":
+            return {"type": "jobs", "jobs": jobs.list(cmd.get("session"))}
+        
+        elif cmd_type in ("job_status", "cancel"):
+            try:
+                job_id = int(cmd.get("job_id"))
+            except (TypeError, ValueError):
+                return {"type": "error", "error": "No job id provided"}
+            job = jobs.cancel(job_id, cmd.get("session")) if cmd_type == "cancel" else jobs.get(job_id, cmd.get("session"))
+            if job is None:
+                return {"type": "error", "error": f"Unknown job: {job_id}"}
+            return {"type": "job", **job.to_dict()}
                 
         elif cmd_type == "inspect":
             try:
@@ -387,48 +2502,99 @@ def handle_command(cmd, globals_dict, executor, writer, sock, output_queue):
                 if not expr:
                     return {"type": "error", "error": "No expression provided"}
                 
-                # Handle nested attribute access
-                parts = []
-                current = ""
-                in_brackets = False
-                for char in expr:
-                    if char == '[':
-                        if current:
-                            parts.append(('attr', current))
-                            current = ""
-                        in_brackets = True
-                    elif char == ']':
-                        if current:
-                            parts.append(('key', current.strip("'")))
-                            current = ""
-                        in_brackets = False
-                    elif char == '.' and not in_brackets:
-                        if current:
-                            parts.append(('attr', current))
-                            current = ""
-                    else:
-                        current += char
-                if current:
-                    parts.append(('attr', current))
-                
-                # Evaluate the expression part by part
-                obj = None
-                for i, (access_type, name) in enumerate(parts):
-                    if i == 0:
-                        # First part is always evaluated in globals
-                        obj = eval(name, globals_dict, globals_dict)
-                    else:
-                        # Subsequent parts are accessed as attributes or keys
-                        if access_type == 'key':
-                            try:
-                                obj = obj[name]  # Try dict-style access first
-                            except (TypeError, KeyError):
-                                obj = getattr(obj, name)  # Fall back to attribute access
-                        else:
-                            obj = getattr(obj, name)
+                obj = resolve_inspect_path(expr, globals_dict)
+                if cmd.get("mode") == "summary":
+                    # Summaries always list members afresh, the pages the client fetches next reuse them
+                    member_names = member_names_cache.get(cmd.get("session"), expr, obj, refresh=True)
+                    return {"type": "inspect_summary", "expression": expr, "data": get_object_summary(obj, member_names=member_names)}
                 
                 info = get_object_info(obj)
-                return {"type": "inspect_result", "data": info}
+                since = cmd.get("since")
+                if 'attributes' not in info or not (since or cmd.get("versioned")):
+                    return {"type": "inspect_result", "expression": expr, "data": info}
+                
+                # Clients that send back the version they hold only get what changed since
+                session_id = cmd.get("session")
+                add_fingerprints(info)
+                old_fingerprints = inspect_history.get(session_id, expr, since) if since else None
+                inspect_history.put(session_id, expr, info['version'], info['fingerprints'])
+                if old_fingerprints is not None:
+                    return {"type": "inspect_delta", "expression": expr, "data": get_object_delta(info, old_fingerprints, since)}
+                return {"type": "inspect_result", "expression": expr, "data": info}
+            except Exception as e:
+                return {"type": "error", "error": str(e)}
+        elif cmd_type == "watch":
+            expr = str(cmd.get("expression", ""))
+            if not expr:
+                return {"type": "error", "error": "No expression provided"}
+            interval = max(float(cmd.get("interval") or DEFAULT_WATCH_INTERVAL), MIN_WATCH_INTERVAL)
+            try:
+                watch = watches.add(expr, globals_dict, cmd.get("session"), interval, writer)
+            except (SyntaxError, ValueError) as e:
+                return {"type": "error", "error": f"Cannot watch {expr}: {e}"}
+            return {"type": "watch", **watch.to_dict()}
+        
+        elif cmd_type == "unwatch":
+            try:
+                watch_id = int(cmd.get("watch_id"))
+            except (TypeError, ValueError):
+                return {"type": "error", "error": "No watch id provided"}
+            watch = watches.remove(watch_id, cmd.get("session"))
+            if watch is None:
+                return {"type": "error", "error": f"Unknown watch: {watch_id}"}
+            return {"type": "unwatch", "watch_id": watch_id}
+        
+        elif cmd_type == "watches":
+            return {"type": "watches", "watches": watches.list(cmd.get("session"))}
+        
+        elif cmd_type == "inspect_batch":
+            try:
+                return inspect_batch(cmd, globals_dict)
+            except Exception as e:
+                return {"type": "error", "error": str(e)}
+        elif cmd_type == "graph":
+            try:
+                expr = str(cmd.get("expression", ""))
+                if not expr:
+                    return {"type": "error", "error": "No expression provided"}
+                obj = resolve_inspect_path(expr, globals_dict)
+            except Exception as e:
+                return {"type": "error", "error": str(e)}
+            return start_object_graph(cmd, obj, writer)
+        elif cmd_type == "profile":
+            return start_profile(cmd, writer)
+        
+        elif cmd_type == "heap":
+            return handle_heap_command(cmd, executor, writer)
+        
+        elif cmd_type == "stats":
+            if cmd.get("reset"):
+                agent_stats.reset()
+            if "interval" in cmd:
+                interval = float(cmd.get("interval") or 0)
+                if interval > 0:
+                    agent_stats.start_reporting(max(interval, MIN_STATS_INTERVAL), writer, output_queue, cmd.get("session"))
+                else:
+                    agent_stats.stop_reporting()
+            return {"type": "stats", "data": agent_stats.get_report(writer, output_queue)}
+        
+        elif cmd_type == "session_close":
+            # The periodic stats reports go to the session that asked for them
+            if agent_stats.reporter is not None and agent_stats.reporter_session == cmd.get("session"):
+                agent_stats.stop_reporting()
+            watches.drop_session(cmd.get("session"))
+            close_session(cmd.get("session"))
+            return None
+        elif cmd_type == "inspect_page":
+            try:
+                expr = str(cmd.get("expression", ""))
+                if not expr:
+                    return {"type": "error", "error": "No expression provided"}
+                
+                obj = resolve_inspect_path(expr, globals_dict)
+                member_names = member_names_cache.get(cmd.get("session"), expr, obj)
+                page = get_object_page(obj, cmd.get("section", "attributes"), cmd.get("offset", 0), cmd.get("limit", DEFAULT_PAGE_SIZE), member_names)
+                return {"type": "inspect_page", "expression": expr, "data": page}
             except Exception as e:
                 return {"type": "error", "error": str(e)}
         else:
@@ -436,99 +2602,104 @@ def handle_command(cmd, globals_dict, executor, writer, sock, output_queue):
     except Exception as e:
         return {"type": "error", "error": f"Command handling error: {str(e)}"}
 
-def connect_socket(host, port, timeout=5):
+async def connect_socket(loop, host, port, timeout=5):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setblocking(False)
-    r = s.connect_ex((host, port))
-    if r not in (0, 10035):
+    try:
+        await asyncio.wait_for(loop.sock_connect(s, (host, port)), timeout)
+    except (OSError, asyncio.TimeoutError):
+        s.close()
         return None
-    
-    start_time = time.time()
-    while True:
-        _, w, _ = select.select([], [s], [], 0.05)
-        if s in w:
-            e = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
-            if e != 0:
-                s.close()
-                return None
-            return s
-        if time.time() - start_time > timeout:
-            s.close()
-            return None
+    return s
 
-def run_repl(host, port):
-    # Create a thread pool for executing code
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        while True:
-            try:
-                s = connect_socket(host, port)
-                
-                if not s:
-                    time.sleep(5)
-                    continue
+async def pump_output(output_queue, writer):
+    while True:
+        await output_queue.wait()
+        # Linger briefly so output written in quick succession shares a frame,
+        # and leave output queued (blocking its writers) while the socket is behind
+        await asyncio.sleep(OUTPUT_FLUSH_INTERVAL)
+        await writer.drain()
+        send_output(output_queue, writer)
 
-                writer = ThreadSafeSocketWriter(s)
-                # Create an output queue instead of redirecting global stdout
-                output_queue = queue.Queue()
+async def serve_connection(loop, s, executor):
+    codec = MessageCodec()
+    writer = AgentConnection(loop, s, codec)
+    output_queue = OutputQueue(loop)
+    tasks = [
+        asyncio.create_task(writer.run_writer()),
+        asyncio.create_task(pump_output(output_queue, writer))
+    ]
 
-                response = {
-                    "type": "status",
-                    "status": "connected",
-                    "message": "Python API endpoint ready"
-                }
-                s.sendall(json.dumps(response).encode("utf-8") + b"\n")
+    response = {
+        "type": "status",
+        "status": "connected",
+        "message": "Python API endpoint ready",
+        "framing": codec.get_offer()
+    }
+    writer.send(response)
 
-                buf = b""
-                running = True
+    try:
+        while True:
+            data = await loop.sock_recv(s, 65536)
+            if not data:
+                break
+            for payload, flags in codec.feed(data):
+                try:
+                    start = time.perf_counter()
+                    cmd = codec.decode(payload, flags)
+                    decoded = time.perf_counter()
+                    if cmd.get("type") == "exit":
+                        return
+                    if cmd.get("type") == "framing":
+                        # Server picked a framing mode, applies to everything sent from now on
+                        codec.configure(cmd)
+                        continue
+                    
+                    session = get_session(cmd.get("session"))
+                    response = handle_command(cmd, session.globals, executor, writer, s, output_queue)
+                    handled = time.perf_counter()
+                    if response:  # Only send immediate responses (non-REPL commands)
+                        writer.send(tag_session(response, cmd.get("session"), cmd.get("request_id")))
+                    # Client-supplied types are not trusted as stats keys, the table would grow with each one
+                    cmd_type = cmd.get("type")
+                    if not isinstance(cmd_type, str) or cmd_type not in COMMAND_TYPES:
+                        cmd_type = "unknown"
+                    agent_stats.record(cmd_type, "decode", decoded - start)
+                    agent_stats.record(cmd_type, "handle", handled - decoded)
+                    agent_stats.record(cmd_type, "encode", time.perf_counter() - handled)
+                except (json.JSONDecodeError, zlib.error):
+                    response = {"type": "error", "error": "Invalid JSON"}
+                    writer.send(response)
+                except Exception as e:
+                    response = {"type": "error", "error": str(e)}
+                    writer.send(response)
+    finally:
+        agent_stats.stop_reporting()
+        watches.clear()
+        # Census and graph walks stream to this connection, and would wait on its writer forever
+        for task in itertools.chain(tasks, list(background_tasks)):
+            task.cancel()
+        s.close()
 
-                while running:
-                    # Check for output from worker threads
-                    try:
-                        while True:  # Process all pending output
-                            output = output_queue.get_nowait()
-                            if output:
-                                s.sendall(json.dumps(output).encode("utf-8") + b"\n")
-                    except queue.Empty:
-                        pass
-
-                    # Check for socket input
-                    rs, _, _ = select.select([s], [], [], 0.05)
-                    if s in rs:
-                        data = s.recv(4096)
-                        if not data:
-                            break
-                        buf += data
-                        while b"\n" in buf:
-                            line, _, buf = buf.partition(b"\n")
-                            try:
-                                cmd = json.loads(line.decode("utf-8", "replace"))
-                                if cmd.get("type") == "exit":
-                                    running = False
-                                    response = {"type": "status", "status": "disconnected"}
-                                    break
-                                
-                                response = handle_command(cmd, globals(), executor, writer, s, output_queue)
-                                if response:  # Only send immediate responses (non-REPL commands)
-                                    s.sendall(json.dumps(response).encode("utf-8") + b"\n")
-                            except json.JSONDecodeError:
-                                response = {"type": "error", "error": "Invalid JSON"}
-                                s.sendall(json.dumps(response).encode("utf-8") + b"\n")
-                            except Exception as e:
-                                response = {"type": "error", "error": str(e)}
-                                s.sendall(json.dumps(response).encode("utf-8") + b"\n")
-
-                s.close()
-
-            except KeyboardInterrupt:
-                sys.exit(0)
+async def agent_main(host, port):
+    loop = asyncio.get_running_loop()
+    install_output_router()
+    # Create a thread pool for executing code
+    with ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS) as executor:
+        while True:
+            try:
+                s = await connect_socket(loop, host, port)
+                if s:
+                    await serve_connection(loop, s, executor)
             except Exception as e:
                 print(f"Connection error: {e}")
-                
-            try:
-                s.close()
-            except:
-                pass
-                
-            time.sleep(5)
+            
+            await asyncio.sleep(5)
+
+def run_repl(host, port):
+    try:
+        asyncio.run(agent_main(host, port))
+    except KeyboardInterrupt:
+        sys.exit(0)
 
 run_repl("__HOST__", __PORT__)
@@ -9,6 +9,10 @@ const inspectForward = document.getElementById('inspect-forward');
 const inspectorResult = document.getElementById('inspector-result');
 let currentGraph = null;
 
+// Paged inspection state
+const PAGE_SIZE = 100;
+let currentInspect = null;
+
 // Path history tracking
 let pathHistory = [];
 let currentPathIndex = -1;
@@ -31,9 +35,25 @@ function navigateToPath(path, addToHistory = true) {
     inspectInput.value = path;
     updateNavigationButtons();
     
+    requestInspect(path);
+}
+
+// Request a cheap summary first, members are then fetched page by page
+function requestInspect(expression) {
     socket.emit('execute', {
         type: 'inspect',
-        expression: path
+        expression: expression,
+        mode: 'summary'
+    });
+}
+
+function requestInspectPage(expression, section, offset) {
+    socket.emit('execute', {
+        type: 'inspect_page',
+        expression: expression,
+        section: section,
+        offset: offset,
+        limit: PAGE_SIZE
     });
 }
 
@@ -61,10 +81,7 @@ function inspectExpression() {
         currentPathIndex = 0;
         updateNavigationButtons();
         
-        socket.emit('execute', {
-            type: 'inspect',
-            expression: expression
-        });
+        requestInspect(expression);
     }
 }
 
@@ -112,7 +129,29 @@ function addOutputLine(text, type = 'output') {
     output.scrollTop = output.scrollHeight;
 }
 
+// Jobs of this client that are queued or running
+const activeJobs = new Set();
+
+socket.on('job', (job) => {
+    if (job.status === 'queued' || job.status === 'running') {
+        activeJobs.add(job.job_id);
+    } else {
+        activeJobs.delete(job.job_id);
+    }
+});
+
 input.addEventListener('keydown', (e) => {
+    // Ctrl+C without a selection cancels the most recent job
+    if (e.key === 'c' && e.ctrlKey && input.selectionStart === input.selectionEnd && activeJobs.size > 0) {
+        e.preventDefault();
+        const jobId = Math.max(...activeJobs);
+        addOutputLine(`^C (cancelling job ${jobId})`, 'command');
+        socket.emit('execute', {
+            type: 'cancel',
+            job_id: jobId
+        });
+        return;
+    }
     if (e.key === 'Enter') {
         if (e.shiftKey) {
             e.preventDefault();
@@ -170,6 +209,85 @@ socket.on('inspect_result', (result) => {
     }
 });
 
+socket.on('inspect_summary', (result) => {
+    console.log('Received inspect summary:', result);
+    const data = result.data;
+    if (!data) {
+        console.error('Invalid inspect summary:', result);
+        return;
+    }
+    const container = document.getElementById('tree-container');
+    if (!container) {
+        console.error('Tree container not found');
+        return;
+    }
+    const path = result.expression;
+    container.innerHTML = '';
+    container.appendChild(createMetadataHeader(data));
+    if (data.type === 'error') {
+        currentInspect = null;
+        return;
+    }
+
+    const rootNode = document.createElement('div');
+    rootNode.className = 'tree-root';
+    const sections = {};
+    [['methods', data.method_count], ['attributes', data.attribute_count]].forEach(([section, count]) => {
+        if (count > 0) {
+            const sectionNode = document.createElement('div');
+            sectionNode.className = 'tree-section';
+            rootNode.appendChild(sectionNode);
+            sections[section] = sectionNode;
+        }
+    });
+    container.appendChild(rootNode);
+
+    currentInspect = {
+        path: path,
+        isDict: data.category === 'dictionary' || path.includes('sys.modules'),
+        sections: sections,
+        names: new Set(data.attribute_names || [])
+    };
+    Object.keys(sections).forEach(section => requestInspectPage(path, section, 0));
+});
+
+socket.on('inspect_page', (result) => {
+    // Ignore pages of an expression that is no longer shown
+    if (!currentInspect || result.expression !== currentInspect.path || !result.data) {
+        return;
+    }
+    const page = result.data;
+    const sectionNode = currentInspect.sections[page.section];
+    if (!sectionNode) {
+        return;
+    }
+    const loadMore = sectionNode.querySelector('.load-more');
+    if (loadMore) {
+        loadMore.remove();
+    }
+
+    Object.entries(page.items || {}).forEach(([name, info]) => {
+        // Only show top-level modules of sys.modules
+        if (currentInspect.path === 'sys.modules' && name.includes('.') && currentInspect.names.has(name.split('.')[0])) {
+            return;
+        }
+        sectionNode.appendChild(createTreeNode(name, info, currentInspect.path, currentInspect.isDict));
+    });
+
+    const nextOffset = page.offset + page.limit;
+    if (nextOffset < page.total) {
+        const button = document.createElement('button');
+        button.className = 'load-more';
+        button.textContent = `Load more (${page.total - nextOffset} remaining)`;
+        const path = currentInspect.path;
+        button.onclick = () => {
+            button.disabled = true;
+            requestInspectPage(path, page.section, nextOffset);
+        };
+        sectionNode.appendChild(button);
+    }
+});
+
 // Tab handling
 document.querySelectorAll('.tab-button').forEach(button => {
     button.addEventListener('click', () => {
@@ -523,3 +641,383 @@ document.getElementById('modules-shortcut').addEventListener('click', () => {
     inspectInput.value = 'sys.modules';
     inspectExpression();
 });
+
+// Watches: the agent pushes a new value only when it changes
+const watchButton = document.getElementById('watch-button');
+const watchList = document.getElementById('watch-list');
+const WATCH_INTERVAL = 1;
+
+watchButton.addEventListener('click', () => {
+    const expression = inspectInput.value.trim();
+    if (expression) {
+        socket.emit('execute', { type: 'watch', expression: expression, interval: WATCH_INTERVAL });
+    }
+});
+
+socket.on('watch', (watch) => {
+    const row = document.createElement('div');
+    row.className = 'watch-row';
+    row.dataset.watchId = watch.watch_id;
+
+    const expression = document.createElement('span');
+    expression.className = 'watch-expression';
+    expression.textContent = watch.expression;
+    expression.onclick = () => navigateToPath(watch.expression);
+
+    const value = document.createElement('span');
+    value.className = 'watch-value';
+
+    const remove = document.createElement('button');
+    remove.className = 'watch-remove';
+    remove.textContent = '×';
+    remove.onclick = () => {
+        socket.emit('execute', { type: 'unwatch', watch_id: watch.watch_id });
+        row.remove();
+    };
+
+    row.appendChild(expression);
+    row.appendChild(value);
+    row.appendChild(remove);
+    watchList.appendChild(row);
+});
+
+socket.on('watch_update', (update) => {
+    const row = watchList.querySelector(`.watch-row[data-watch-id="${update.watch_id}"]`);
+    if (!row) {
+        return;
+    }
+    const value = row.querySelector('.watch-value');
+    value.classList.toggle('error', Boolean(update.error));
+    value.textContent = update.error || `${update.value} (${update.value_type})`;
+    value.title = new Date(update.time * 1000).toLocaleTimeString();
+});
+
+// Profiler
+const profileButton = document.getElementById('profile-button');
+const profileStatus = document.getElementById('profile-status');
+const flamegraphContainer = document.getElementById('flamegraph-container');
+
+profileButton.addEventListener('click', () => {
+    profileButton.disabled = true;
+    profileStatus.textContent = 'Starting profiler...';
+    socket.emit('execute', {
+        type: 'profile',
+        duration: parseFloat(document.getElementById('profile-duration').value) || 5,
+        rate: parseInt(document.getElementById('profile-rate').value, 10) || 100
+    });
+});
+
+socket.on('profile_started', (message) => {
+    profileStatus.textContent = `Sampling ${message.rate}/s for ${message.duration}s...`;
+});
+
+socket.on('profile_result', (result) => {
+    profileButton.disabled = false;
+    profileStatus.textContent = `${result.samples} samples in ${result.duration.toFixed(1)}s`;
+    renderFlamegraph(result.tree, flamegraphContainer);
+});
+
+function renderFlamegraph(tree, container) {
+    container.innerHTML = '';
+    if (typeof d3 === 'undefined') {
+        container.textContent = 'd3 is not available, run npm install';
+        return;
+    }
+    if (!tree.value) {
+        container.textContent = 'No samples collected';
+        return;
+    }
+
+    const cellHeight = 18;
+    const width = container.clientWidth || 960;
+    const root = d3.partition()(d3.hierarchy(tree).sum(d => d.self).sort((a, b) => b.value - a.value));
+    const x = d3.scaleLinear().range([0, width]);
+    const height = (root.height + 1) * cellHeight;
+    const color = d3.scaleOrdinal(d3.schemeTableau10);
+
+    const svg = d3.select(container)
+        .append('svg')
+        .attr('class', 'flamegraph')
+        .attr('width', width)
+        .attr('height', height);
+
+    const cell = svg.selectAll('g')
+        .data(root.descendants())
+        .join('g')
+        .attr('class', 'flame-cell');
+
+    cell.append('rect')
+        .attr('height', cellHeight - 1)
+        .attr('fill', d => color(d.data.name.split(' ')[0]));
+
+    cell.append('text')
+        .attr('x', 4)
+        .attr('y', cellHeight / 2)
+        .attr('dy', '0.35em');
+
+    cell.append('title')
+        .text(d => `${d.data.name}\n${d.value} samples (${(100 * d.value / root.value).toFixed(1)}%)`);
+
+    // Click a frame to zoom into it, click the root to zoom out
+    function zoom(focus) {
+        x.domain([focus.x0, focus.x1]);
+        cell.attr('transform', d => `translate(${x(d.x0)},${d.depth * cellHeight})`)
+            .style('display', d => (x(d.x1) - x(d.x0) < 1 || d.x1 <= focus.x0 || d.x0 >= focus.x1) ? 'none' : null);
+        cell.select('rect').attr('width', d => Math.max(0, x(d.x1) - x(d.x0) - 1));
+        cell.select('text').text(d => {
+            const chars = Math.floor((x(d.x1) - x(d.x0) - 8) / 7);
+            return chars < 3 ? '' : d.data.name.length > chars ? d.data.name.slice(0, chars - 1) + '…' : d.data.name;
+        });
+    }
+
+    cell.on('click', (event, d) => zoom(d));
+    zoom(root);
+}
+
+// Heap
+const heapCensusButton = document.getElementById('heap-census-button');
+const heapTraceButton = document.getElementById('heap-trace-button');
+const heapSnapshotButton = document.getElementById('heap-snapshot-button');
+const heapDiffButton = document.getElementById('heap-diff-button');
+const heapStatus = document.getElementById('heap-status');
+const heapContainer = document.getElementById('heap-container');
+let heapTracing = false;
+let heapSnapshots = [];
+
+function formatBytes(size) {
+    const units = ['B', 'KiB', 'MiB', 'GiB'];
+    let value = Math.abs(size);
+    let unit = 0;
+    while (value >= 1024 && unit < units.length - 1) {
+        value /= 1024;
+        unit++;
+    }
+    return `${size < 0 ? '-' : ''}${unit ? value.toFixed(1) : value} ${units[unit]}`;
+}
+
+function renderHeapTable(columns, rows) {
+    const table = document.createElement('table');
+    table.className = 'heap-table';
+    const header = table.insertRow();
+    columns.forEach(column => {
+        const th = document.createElement('th');
+        th.textContent = column.label;
+        header.appendChild(th);
+    });
+    rows.forEach(row => {
+        const tr = table.insertRow();
+        columns.forEach(column => {
+            tr.insertCell().textContent = column.value(row);
+        });
+        if (row.expression) {
+            // Drill into the type with the object inspector
+            tr.classList.add('heap-link');
+            tr.addEventListener('click', () => {
+                document.querySelector('.tab-button[data-tab="inspector"]').click();
+                navigateToPath(row.expression);
+            });
+        }
+    });
+    heapContainer.innerHTML = '';
+    heapContainer.appendChild(table);
+}
+
+function sendHeapCommand(action, options = {}) {
+    socket.emit('execute', { type: 'heap', action: action, ...options });
+}
+
+heapCensusButton.addEventListener('click', () => {
+    heapCensusButton.disabled = true;
+    heapStatus.textContent = 'Counting objects...';
+    sendHeapCommand('census');
+});
+
+heapTraceButton.addEventListener('click', () => {
+    sendHeapCommand(heapTracing ? 'trace_stop' : 'trace_start');
+});
+
+heapSnapshotButton.addEventListener('click', () => {
+    heapStatus.textContent = 'Taking snapshot...';
+    sendHeapCommand('snapshot');
+});
+
+heapDiffButton.addEventListener('click', () => {
+    heapStatus.textContent = 'Comparing with the last snapshot...';
+    sendHeapCommand('diff', { base: heapSnapshots[heapSnapshots.length - 1] });
+});
+
+socket.on('heap_census', (census) => {
+    heapCensusButton.disabled = !census.done;
+    heapStatus.textContent = `${census.done ? 'Counted' : 'Counting...'} ${census.scanned.toLocaleString()} objects, ` +
+        `${census.type_count.toLocaleString()} types, ${formatBytes(census.size)}`;
+    renderHeapTable([
+        { label: 'Type', value: row => row.module && row.module !== 'builtins' ? `${row.module}.${row.name}` : row.name },
+        { label: 'Category', value: row => row.category },
+        { label: 'Count', value: row => row.count.toLocaleString() },
+        { label: 'Size', value: row => formatBytes(row.size) }
+    ], census.types);
+});
+
+socket.on('heap_trace', (status) => {
+    heapTracing = status.tracing;
+    heapSnapshots = status.snapshots;
+    heapTraceButton.textContent = heapTracing ? 'Stop tracemalloc' : 'Start tracemalloc';
+    heapSnapshotButton.disabled = !heapTracing;
+    heapDiffButton.disabled = !heapTracing || heapSnapshots.length === 0;
+    heapStatus.textContent = heapTracing ? `Tracing, ${formatBytes(status.current)} traced (peak ${formatBytes(status.peak)})` : 'Not tracing';
+});
+
+const traceColumns = [
+    { label: 'Location', value: row => `${row.file}:${row.line}` },
+    { label: 'Source', value: row => row.source },
+    { label: 'Size', value: row => formatBytes(row.size) },
+    { label: 'Count', value: row => row.count.toLocaleString() }
+];
+
+socket.on('heap_snapshot', (snapshot) => {
+    heapSnapshots.push(snapshot.id);
+    heapDiffButton.disabled = false;
+    heapStatus.textContent = `Snapshot ${snapshot.id}: ${formatBytes(snapshot.size)} in ${snapshot.count.toLocaleString()} blocks`;
+    renderHeapTable(traceColumns, snapshot.lines);
+});
+
+socket.on('heap_diff', (diff) => {
+    heapSnapshots.push(diff.target);
+    heapStatus.textContent = `Snapshot ${diff.target} vs ${diff.base}: ${diff.size_diff >= 0 ? '+' : ''}${formatBytes(diff.size_diff)}`;
+    renderHeapTable([
+        ...traceColumns,
+        { label: 'Size change', value: row => `${row.size_diff >= 0 ? '+' : ''}${formatBytes(row.size_diff)}` },
+        { label: 'Count change', value: row => `${row.count_diff >= 0 ? '+' : ''}${row.count_diff}` }
+    ], diff.lines);
+});
+
+// Object graph: referrers or referents of an object, streamed in batches into a force layout
+const graphInput = document.getElementById('graph-input');
+const graphButton = document.getElementById('graph-button');
+const graphStatus = document.getElementById('graph-status');
+const graphContainer = document.getElementById('graph-container');
+
+graphButton.addEventListener('click', () => {
+    const expression = graphInput.value.trim() || inspectInput.value.trim();
+    if (!expression) {
+        return;
+    }
+    graphInput.value = expression;
+    graphButton.disabled = true;
+    graphStatus.textContent = 'Walking...';
+    socket.emit('execute', {
+        type: 'graph',
+        expression: expression,
+        direction: document.getElementById('graph-direction').value,
+        max_depth: parseInt(document.getElementById('graph-depth').value, 10) || 2,
+        max_nodes: parseInt(document.getElementById('graph-nodes').value, 10) || 200
+    });
+});
+
+socket.on('graph_started', (graph) => {
+    currentGraph = createForceGraph(graph, graphContainer);
+});
+
+socket.on('graph_batch', (batch) => {
+    if (!currentGraph || batch.graph_id !== currentGraph.id) {
+        return;
+    }
+    currentGraph.add(batch.nodes, batch.edges);
+    if (batch.done) {
+        graphButton.disabled = false;
+        const truncated = batch.truncated ? `, stopped at the ${batch.truncated} budget` : '';
+        graphStatus.textContent = `${batch.node_count} objects, ${batch.edge_count} references${truncated}`;
+    } else {
+        graphStatus.textContent = `Walking... ${currentGraph.nodes.length} objects`;
+    }
+});
+
+function createForceGraph(graph, container) {
+    container.innerHTML = '';
+    const empty = { id: graph.graph_id, nodes: [], add: () => {} };
+    if (typeof d3 === 'undefined') {
+        container.textContent = 'd3 is not available, run npm install';
+        return empty;
+    }
+
+    const width = container.clientWidth || 960;
+    const height = container.clientHeight || 600;
+    const color = d3.scaleOrdinal(d3.schemeTableau10);
+    const svg = d3.select(container).append('svg').attr('viewBox', [-width / 2, -height / 2, width, height]);
+    const view = svg.append('g');
+    svg.call(d3.zoom().scaleExtent([0.1, 8]).on('zoom', (event) => view.attr('transform', event.transform)));
+    svg.append('defs').append('marker')
+        .attr('id', 'graph-arrow')
+        .attr('viewBox', '0 -4 8 8')
+        .attr('refX', 14)
+        .attr('markerWidth', 6)
+        .attr('markerHeight', 6)
+        .attr('orient', 'auto')
+        .append('path')
+        .attr('d', 'M0,-4L8,0L0,4')
+        .attr('fill', '#565f89');
+    let link = view.append('g').selectAll('line');
+    let node = view.append('g').selectAll('g');
+
+    const nodes = [];
+    const links = [];
+    const simulation = d3.forceSimulation(nodes)
+        .force('link', d3.forceLink(links).id(d => d.id).distance(60))
+        .force('charge', d3.forceManyBody().strength(-120))
+        .force('x', d3.forceX())
+        .force('y', d3.forceY())
+        .on('tick', () => {
+            link.attr('x1', d => d.source.x).attr('y1', d => d.source.y)
+                .attr('x2', d => d.target.x).attr('y2', d => d.target.y);
+            node.attr('transform', d => `translate(${d.x},${d.y})`);
+        });
+
+    function drag() {
+        return d3.drag()
+            .on('start', (event, d) => {
+                if (!event.active) simulation.alphaTarget(0.3).restart();
+                d.fx = d.x;
+                d.fy = d.y;
+            })
+            .on('drag', (event, d) => {
+                d.fx = event.x;
+                d.fy = event.y;
+            })
+            .on('end', (event, d) => {
+                if (!event.active) simulation.alphaTarget(0);
+                d.fx = null;
+                d.fy = null;
+            });
+    }
+
+    function add(newNodes, newEdges) {
+        nodes.push(...newNodes);
+        links.push(...newEdges);
+
+        node = node.data(nodes, d => d.id).join(enter => {
+            const g = enter.append('g')
+                .attr('class', d => d.depth === 0 ? 'node root' : 'node')
+                .call(drag());
+            g.append('circle')
+                .attr('r', d => d.depth === 0 ? 10 : 6)
+                .attr('fill', d => color(d.category));
+            g.append('text')
+                .attr('x', 10)
+                .attr('dy', '0.35em')
+                .text(d => d.type);
+            g.append('title')
+                .text(d => `${d.type} (${d.category}${d.size !== null ? `, ${d.size} bytes` : ''})\n${d.label}`);
+            return g;
+        });
+        link = link.data(links, d => `${d.source.id || d.source}-${d.target.id || d.target}`)
+            .join('line')
+            .attr('class', 'link')
+            .attr('marker-end', 'url(#graph-arrow)');
+
+        simulation.nodes(nodes);
+        simulation.force('link').links(links);
+        simulation.alpha(0.5).restart();
+    }
+
+    return { id: graph.graph_id, nodes: nodes, add: add };
+}
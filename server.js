@@ -4,12 +4,34 @@ const http = require('http').createServer(app);
 const io = require('socket.io')(http);
 const net = require('net');
 const path = require('path');
+const zlib = require('zlib');
+
+// msgpack is optional, frames fall back to JSON without it
+let msgpack = null;
+try {
+    msgpack = require('@msgpack/msgpack');
+} catch (err) {
+    msgpack = null;
+}
 
 const PORT = 3000;
 const PYTHON_PORT = 1337;
 
+// Binary framing: magic byte, flags, 4 byte big-endian payload length
+const FRAME_MAGIC = 0xfe;
+const FRAME_HEADER_SIZE = 6;
+const FRAME_COMPRESSED = 0x01;
+const FRAME_MSGPACK = 0x02;
+const COMPRESSION_THRESHOLD = 4096;
+
+// Relay logging: milliseconds between traffic summaries
+const LOG_INTERVAL = 10000;
+// Requests waiting for their first reply, oldest dropped beyond this
+const MAX_PENDING_REQUESTS = 10000;
+
 // Serve static files
 app.use(express.static('public'));
+app.use('/vendor/d3', express.static(path.join(__dirname, 'node_modules', 'd3', 'dist')));
 
 // Serve main page
 app.get('/', (req, res) => {
@@ -18,54 +40,263 @@ app.get('/', (req, res) => {
 
 // Python connection handler
 let pythonSocket = null;
+// Framing negotiated with the Python agent, JSON lines until the handshake
+let pythonFraming = { mode: 'json', encoding: 'json', compression: null, threshold: COMPRESSION_THRESHOLD };
+
+// Pick a framing mode from the options offered in the agent's status handshake
+function chooseFraming(offer) {
+    if (!offer || !Array.isArray(offer.modes) || !offer.modes.includes('binary')) {
+        return null;
+    }
+    const encodings = offer.encodings || [];
+    return {
+        mode: 'binary',
+        encoding: msgpack && encodings.includes('msgpack') ? 'msgpack' : 'json',
+        compression: (offer.compression || []).includes('zlib') ? 'zlib' : null,
+        threshold: COMPRESSION_THRESHOLD
+    };
+}
+
+function encodeMessage(message, framing) {
+    if (framing.mode !== 'binary') {
+        return Buffer.from(JSON.stringify(message) + '\n');
+    }
+    let flags = 0;
+    let payload;
+    if (framing.encoding === 'msgpack') {
+        const encoded = msgpack.encode(message);
+        payload = Buffer.from(encoded.buffer, encoded.byteOffset, encoded.byteLength);
+        flags |= FRAME_MSGPACK;
+    } else {
+        payload = Buffer.from(JSON.stringify(message));
+    }
+    if (framing.compression === 'zlib' && payload.length >= framing.threshold) {
+        payload = zlib.deflateSync(payload, { level: 1 });
+        flags |= FRAME_COMPRESSED;
+    }
+    const header = Buffer.alloc(FRAME_HEADER_SIZE);
+    header[0] = FRAME_MAGIC;
+    header[1] = flags;
+    header.writeUInt32BE(payload.length, 2);
+    return Buffer.concat([header, payload]);
+}
+
+function decodePayload(payload, flags) {
+    if (flags & FRAME_COMPRESSED) {
+        payload = zlib.inflateSync(payload);
+    }
+    if (flags & FRAME_MSGPACK) {
+        if (!msgpack) {
+            throw new Error('Received a msgpack frame but @msgpack/msgpack is not installed');
+        }
+        return msgpack.decode(payload);
+    }
+    return JSON.parse(payload.toString('utf8'));
+}
+
+// Web client that sent each request, by request id
+const pendingRequests = new Map();
+let nextRequestId = 1;
+
+function trackRequest(command, socketId) {
+    command.request_id = nextRequestId++;
+    pendingRequests.set(command.request_id, socketId);
+    if (pendingRequests.size > MAX_PENDING_REQUESTS) {
+        pendingRequests.delete(pendingRequests.keys().next().value);
+    }
+}
+
+// Send a Python reply to the web client that asked for it or whose session it belongs to,
+// only replies that belong to no one are broadcast
+function emitReply(message, event, payload) {
+    let target = message.session;
+    if (message.request_id !== undefined && pendingRequests.has(message.request_id)) {
+        target = pendingRequests.get(message.request_id);
+        pendingRequests.delete(message.request_id);
+    }
+    relayStats.emitted++;
+    if (target) {
+        io.to(target).emit(event, payload);
+    } else {
+        relayStats.broadcast++;
+        io.emit(event, payload);
+    }
+}
+
+// Traffic counters, logged as a periodic summary instead of per message
+const relayStats = { bytes: 0, messages: 0, emitted: 0, broadcast: 0, commands: 0, types: {} };
+
+function countMessage(message, size) {
+    relayStats.messages++;
+    relayStats.bytes += size;
+    relayStats.types[message.type] = (relayStats.types[message.type] || 0) + 1;
+}
+
+setInterval(() => {
+    if (!relayStats.messages && !relayStats.commands) {
+        return;
+    }
+    const types = Object.entries(relayStats.types).map(([type, count]) => `${type}=${count}`).join(' ');
+    console.log(`[Relay] ${relayStats.commands} commands, ${relayStats.messages} messages (${relayStats.bytes} bytes): ${types}; ` +
+        `${relayStats.emitted} emitted, ${relayStats.broadcast} broadcast, ${pendingRequests.size} pending`);
+    Object.assign(relayStats, { bytes: 0, messages: 0, emitted: 0, broadcast: 0, commands: 0, types: {} });
+}, LOG_INTERVAL).unref();
+
+// Split buffered data into JSON lines and binary frames, returns the unconsumed rest
+function readMessages(buffer, onPayload) {
+    let offset = 0;
+    while (offset < buffer.length) {
+        if (buffer[offset] === FRAME_MAGIC) {
+            if (buffer.length - offset < FRAME_HEADER_SIZE) {
+                break;
+            }
+            const length = buffer.readUInt32BE(offset + 2);
+            const end = offset + FRAME_HEADER_SIZE + length;
+            if (buffer.length < end) {
+                break;
+            }
+            onPayload(buffer.subarray(offset + FRAME_HEADER_SIZE, end), buffer[offset + 1]);
+            offset = end;
+        } else {
+            const newlineIndex = buffer.indexOf(0x0a, offset);
+            if (newlineIndex === -1) {
+                break;
+            }
+            onPayload(buffer.subarray(offset, newlineIndex), 0);
+            offset = newlineIndex + 1;
+        }
+    }
+    return buffer.subarray(offset);
+}
+
+// Collects received chunks and only joins them once a whole message can be read,
+// so a large frame arriving in many chunks is copied once instead of once per chunk
+class MessageReader {
+    constructor(onPayload) {
+        this.onPayload = onPayload;
+        this.chunks = [];
+        this.length = 0;
+        this.needed = 0;
+        this.waitingForNewline = false;
+    }
+
+    push(data) {
+        this.chunks.push(data);
+        this.length += data.length;
+        if (this.length < this.needed || (this.waitingForNewline && data.indexOf(0x0a) === -1)) {
+            return;
+        }
+        const buffer = this.chunks.length === 1 ? this.chunks[0] : Buffer.concat(this.chunks, this.length);
+        const rest = readMessages(buffer, this.onPayload);
+        this.chunks = rest.length ? [rest] : [];
+        this.length = rest.length;
+        this.needed = 0;
+        this.waitingForNewline = false;
+        if (rest.length && rest[0] === FRAME_MAGIC) {
+            this.needed = rest.length < FRAME_HEADER_SIZE ? FRAME_HEADER_SIZE : FRAME_HEADER_SIZE + rest.readUInt32BE(2);
+        } else if (rest.length) {
+            this.waitingForNewline = true;
+        }
+    }
+}
 
 // Create TCP server for Python connection
 const tcpServer = net.createServer((socket) => {
     console.log('Python application connected');
     pythonSocket = socket;
     
-    let buffer = '';
-    socket.on('data', (data) => {
-        buffer += data.toString();
-        console.log(`[Python] Received data:`, data.toString());
-        
-        let newlineIndex;
-        while ((newlineIndex = buffer.indexOf('\n')) !== -1) {
-            const line = buffer.slice(0, newlineIndex);
-            buffer = buffer.slice(newlineIndex + 1);
+    pythonFraming = { mode: 'json', encoding: 'json', compression: null, threshold: COMPRESSION_THRESHOLD };
+    
+    const reader = new MessageReader((payload, flags) => {
+        try {
+            const message = decodePayload(payload, flags);
+            countMessage(message, payload.length);
             
-            try {
-                const message = JSON.parse(line);
-                console.log('[Python] Parsed message:', message);
-                
-                switch (message.type) {
-                    case 'output':
-                        io.emit('output', message.data);
-                        break;
-                    case 'status':
-                        io.emit('pythonStatus', message.status === 'connected');
-                        if (message.message) {
-                            io.emit('output', message.message + '\n');
-                        }
+            switch (message.type) {
+                case 'output':
+                    emitReply(message, 'output', message.data);
+                    break;
+                case 'status':
+                    if (message.stats) {
+                        // Periodic agent stats, not a connection state change
+                        emitReply(message, 'stats', message.stats);
                         break;
-                    case 'success':
+                    }
+                    io.emit('pythonStatus', message.status === 'connected');
+                    if (message.message) {
                         io.emit('output', message.message + '\n');
-                        break;
-                    case 'error':
-                        io.emit('output', 'Error: ' + message.error + '\n');
-                        break;
-                    case 'inspect_result':
-                        console.log('[Python] Emitting inspect result:', message);
-                        io.emit('inspect_result', message);
-                        break;
-                    default:
-                        console.log(`[Python] Unknown message type:`, message.type);
-                }
-            } catch (err) {
-                console.error('[Python] Failed to parse message:', line, err);
+                    }
+                    if (message.framing) {
+                        const framing = chooseFraming(message.framing);
+                        if (framing) {
+                            // The reply still goes out as a JSON line, everything after uses the new framing
+                            socket.write(encodeMessage({ type: 'framing', ...framing }, pythonFraming));
+                            pythonFraming = framing;
+                        }
+                    }
+                    break;
+                case 'success':
+                    emitReply(message, 'output', message.message + '\n');
+                    break;
+                case 'error':
+                    emitReply(message, 'output', 'Error: ' + message.error + '\n');
+                    break;
+                case 'inspect_result':
+                    emitReply(message, 'inspect_result', message);
+                    break;
+                case 'inspect_summary':
+                    emitReply(message, 'inspect_summary', message);
+                    break;
+                case 'inspect_page':
+                    emitReply(message, 'inspect_page', message);
+                    break;
+                case 'inspect_delta':
+                    emitReply(message, 'inspect_delta', message);
+                    break;
+                case 'inspect_batch':
+                    emitReply(message, 'inspect_batch', message);
+                    break;
+                case 'job':
+                    emitReply(message, 'job', message);
+                    break;
+                case 'jobs':
+                    emitReply(message, 'jobs', message.jobs);
+                    break;
+                case 'profile_started':
+                    emitReply(message, 'profile_started', message);
+                    break;
+                case 'profile_result':
+                    emitReply(message, 'profile_result', message.data);
+                    break;
+                case 'stats':
+                    emitReply(message, 'stats', message.data);
+                    break;
+                case 'watch':
+                case 'unwatch':
+                case 'watch_update':
+                    emitReply(message, message.type, message);
+                    break;
+                case 'watches':
+                    emitReply(message, 'watches', message.watches);
+                    break;
+                case 'graph_started':
+                case 'graph_batch':
+                    emitReply(message, message.type, message);
+                    break;
+                case 'heap_census':
+                case 'heap_trace':
+                case 'heap_snapshot':
+                case 'heap_diff':
+                    emitReply(message, message.type, message);
+                    break;
+                default:
+                    console.log(`[Python] Unknown message type:`, message.type);
             }
+        } catch (err) {
+            console.error('[Python] Failed to parse message:', payload.length, 'bytes', err);
         }
     });
+    socket.on('data', (data) => reader.push(data));
 
     socket.on('close', () => {
         console.log('Python connection closed');
@@ -92,10 +323,13 @@ io.on('connection', (socket) => {
     socket.emit('pythonStatus', pythonSocket !== null);
 
     socket.on('execute', (command) => {
-        console.log(`[Web] Executing command:`, command);
+        relayStats.commands++;
         if (pythonSocket) {
             try {
-                pythonSocket.write(JSON.stringify(command) + '\n');
+                // Every web client gets its own Python session, replies are routed back by request and session id
+                command.session = socket.id;
+                trackRequest(command, socket.id);
+                pythonSocket.write(encodeMessage(command, pythonFraming));
             } catch (err) {
                 console.error('[Web] Failed to send command:', err);
                 socket.emit('output', 'Error: Failed to send command to Python\n');
@@ -107,6 +341,14 @@ io.on('connection', (socket) => {
 
     socket.on('disconnect', () => {
         console.log('Web client disconnected');
+        for (const [requestId, socketId] of pendingRequests) {
+            if (socketId === socket.id) {
+                pendingRequests.delete(requestId);
+            }
+        }
+        if (pythonSocket) {
+            pythonSocket.write(encodeMessage({ type: 'session_close', session: socket.id }, pythonFraming));
+        }
     });
 });
 